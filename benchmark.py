@@ -0,0 +1,345 @@
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+
+from constants import TEMP_DIR, IMAGE_WORKERS
+
+BENCH_DIR = TEMP_DIR / "benchmark"
+# эталонные html в раскладке экспорта Google Docs и их результат постобработки встроенным html.parser
+GOLDEN_DIR = Path(__file__).parent / "test" / "golden"
+GOLDEN_SUFFIX = ".expected.html"
+
+
+def make_synthetic_docx(path, images_count=60, size=(1920, 1080)):
+    """Создаёт docx-подобный архив с шумными PNG/JPEG, похожими на скриншоты и фото"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', '<Types/>')
+        z.writestr('word/document.xml', '<w:document>' + '<w:p>text</w:p>' * 5000 + '</w:document>')
+        for i in range(images_count):
+            image = Image.effect_noise(size, 40 + i % 30).convert('RGB')
+            image_format, ext = ('PNG', 'png') if i % 2 else ('JPEG', 'jpeg')
+            img_io = io.BytesIO()
+            image.save(img_io, format=image_format)
+            z.writestr(f'word/media/image{i + 1}.{ext}', img_io.getvalue())
+    return path
+
+
+def add_large_entry(path, size_mb=200, name='word/media/video1.mp4'):
+    """Дописывает в архив большую несжимаемую запись, как встроенное видео"""
+    chunk = 1024 * 1024
+    with zipfile.ZipFile(path, 'a') as z, z.open(name, 'w', force_zip64=True) as target:
+        for _ in range(size_mb):
+            target.write(os.urandom(chunk))
+    return path
+
+
+def _read_dir(directory):
+    return {p.name: p.read_bytes() for p in sorted(Path(directory).glob('*'))}
+
+
+def bench_parallel_transcoding(images_count=60, workers=IMAGE_WORKERS):
+    """Сравнивает последовательное и параллельное перекодирование изображений"""
+    from docx_optimizer import process_docx_images
+
+    docx_path = make_synthetic_docx(BENCH_DIR / "bench.docx", images_count)
+    results = {}
+    for label, worker_count in (("serial", 1), (f"parallel x{workers}", workers)):
+        images_dir = BENCH_DIR / f"images_{worker_count}"
+        images_dir.mkdir(parents=True, exist_ok=True)
+
+        started = time.perf_counter()
+        _, compressed_path, _ = process_docx_images(docx_path, images_dir, workers=worker_count, use_cache=False)
+        elapsed = time.perf_counter() - started
+
+        results[label] = (elapsed, _read_dir(images_dir), Path(compressed_path).read_bytes())
+
+    serial_time, serial_images, serial_docx = results["serial"]
+    print(f"\n{'Режим':<16}{'Время, с':>10}{'Ускорение':>12}")
+    for label, (elapsed, images, docx) in results.items():
+        print(f"{label:<16}{elapsed:>10.2f}{serial_time / elapsed:>11.2f}x")
+        if images != serial_images or docx != serial_docx:
+            print(f"❌ Результат '{label}' отличается от последовательного!")
+
+
+def _peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_streaming_memory(video_mb=200, images_count=10):
+    """
+    Пиковая память при пересборке docx с большим видео внутри.
+    Потоковая запись не должна держать в памяти ни архив, ни крупные записи целиком:
+    прирост пика из-за видео сравнивается с размером самой крупной записи архива.
+    Возвращает False при регрессии
+    """
+    from docx_optimizer import process_docx_images
+
+    base_path = make_synthetic_docx(BENCH_DIR / "bench_base.docx", images_count)
+    video_path = make_synthetic_docx(BENCH_DIR / "bench_video.docx", images_count)
+    add_large_entry(video_path, video_mb)
+    with zipfile.ZipFile(video_path) as z:
+        largest_entry = max(info.file_size for info in z.infolist())
+
+    base_peak = _peak_memory(process_docx_images, base_path, BENCH_DIR / "images_base", workers=1, use_cache=False)
+    peak = _peak_memory(process_docx_images, video_path, BENCH_DIR / "images_video", workers=1, use_cache=False)
+    growth = max(peak - base_peak, 0)
+
+    print(f"\n📄 Самая крупная запись docx: {largest_entry / 2 ** 20:.1f} МБ")
+    print(f"📈 Пик памяти: {base_peak / 2 ** 20:.1f} МБ без видео, {peak / 2 ** 20:.1f} МБ с видео "
+          f"(прирост {growth / largest_entry:.2f} от крупной записи)")
+    if growth > largest_entry / 2:
+        print("❌ Регрессия: крупная запись читается в память целиком")
+        return False
+    return True
+
+
+def make_synthetic_export_html(sections=200):
+    """
+    Html в духе экспорта Google Docs: ссылки-редиректы, картинки в span (с повторами),
+    блоки кода с сущностями, &nbsp;, пустыми строками, вложенными span и отступами
+    """
+    parts = []
+    for i in range(sections):
+        parts.append(f'<p class="c4"><span class="c1">Раздел {i}: текст &laquo;с&raquo; <b>разметкой</b> и '
+                     f'<a class="c7" href="https://www.google.com/url?q=https://example.com/{i}%3Fa%3D1'
+                     f'&amp;sa=D&amp;source=editors&amp;ust=1&amp;usg=AOv">ссылкой</a></span></p>')
+        parts.append(f'<p class="c2"><span style="overflow: hidden; display: inline-block;">'
+                     f'<img alt="" src="images/image{i % 50 + 1}.png" style="width: 601.70px;" title=""></span></p>')
+        parts.append('<p class="c3"><span class="c5">START_CODE_SECTION</span></p>')
+        for line in range(12):
+            indent = f' style="margin-left:{18 * (line % 4)}pt"' if line % 4 else ''
+            parts.append(f'<p class="c6"{indent}><span class="c8">if (a &lt; b &amp;&amp; c &gt; d)&nbsp;{{</span>'
+                         f'<span class="c9">&nbsp;&quot;s{line}&quot;; // ÿ €</span></p>')
+            if line % 5 == 4:
+                parts.append('\n')
+        parts.append('<p class="c3"><span class="c5">END_CODE_SECTION</span></p>')
+    return ('<html><head><meta content="text/html; charset=UTF-8" http-equiv="content-type">'
+            '<style type="text/css">.c1{color:#000}</style></head><body class="c10 doc-content">'
+            + ''.join(parts) + '</body></html>')
+
+
+def _html_fragments(soup):
+    """Части html, которые обязаны совпадать при любом парсере: блоки кода, картинки и ссылки"""
+    return [str(tag) for tag in soup.select('div.code-container, picture, img, a')]
+
+
+def _parser_context():
+    from zip_postprocessor.html_processing.pipeline import TransformContext
+
+    return TransformContext(
+        image_sources={f"image{i}.png": f"image{i}.jpg" for i in range(1, 51, 2)},
+        variants={f"image{i}": [Path(f"image{i}.avif"), Path(f"image{i}.webp")] for i in range(2, 51, 2)}
+    )
+
+
+def bench_html_parsers(sections=2000):
+    """
+    Сравнивает парсеры html на синтетическом экспорте: время по этапам и совпадение
+    блоков кода, картинок и ссылок с эталоном (встроенный html.parser).
+    Затем проверяет эталонные html из GOLDEN_DIR. Возвращает False, если что-то не совпало
+    """
+    from zip_postprocessor.html_processing.pipeline import HtmlDocument
+    from zip_postprocessor.utils.html_parser import available_html_parsers, FALLBACK_HTML_PARSER
+
+    html_content = make_synthetic_export_html(sections)
+    context = _parser_context()
+
+    results = {}
+    for parser in available_html_parsers():
+        document = HtmlDocument(html_content, parser)
+        document.apply_transforms(context)
+        document.render()
+        results[parser] = (document.timings, _html_fragments(document.soup))
+
+    golden = results[FALLBACK_HTML_PARSER][1]
+    passed = True
+    print(f"\n📄 Html: {len(html_content.encode()) / 2 ** 20:.1f} МБ")
+    print(f"{'Парсер':<13}{'Разбор, мс':>12}{'Преобраз., мс':>15}{'Сборка, мс':>12}{'Итого, мс':>11}  Совпадает")
+    for parser, (timings, fragments) in results.items():
+        parse, serialize = timings["parse"] * 1000, timings["serialize"] * 1000
+        total = sum(timings.values()) * 1000
+        same = fragments == golden
+        passed &= same
+        print(f"{parser:<13}{parse:>12.0f}{total - parse - serialize:>15.0f}{serialize:>12.0f}{total:>11.0f}  "
+              f"{'✅' if same else '❌'}")
+
+    return check_golden_html() and passed
+
+
+def check_golden_html(golden_dir=GOLDEN_DIR):
+    """
+    Эталонные html: результат html.parser обязан совпасть с {имя}.expected.html байт в байт,
+    блоки кода, картинки и ссылки остальных парсеров — с результатом html.parser
+    """
+    from zip_postprocessor.html_processing.pipeline import HtmlDocument
+    from zip_postprocessor.utils.html_parser import available_html_parsers, FALLBACK_HTML_PARSER
+
+    context = _parser_context()
+    passed = True
+    print(f"\n{'Эталон':<28}{'Парсер':<13}Совпадает")
+    for html_path in sorted(golden_dir.glob('*.html')):
+        if html_path.name.endswith(GOLDEN_SUFFIX):
+            continue
+        html_content = html_path.read_text(encoding='utf-8')
+        expected = html_path.with_name(html_path.stem + GOLDEN_SUFFIX).read_text(encoding='utf-8')
+
+        reference = HtmlDocument(html_content, FALLBACK_HTML_PARSER)
+        reference.apply_transforms(context)
+        checks = {FALLBACK_HTML_PARSER: reference.render() == expected}
+        for parser in available_html_parsers():
+            if parser != FALLBACK_HTML_PARSER:
+                document = HtmlDocument(html_content, parser)
+                document.apply_transforms(context)
+                checks[parser] = _html_fragments(document.soup) == _html_fragments(reference.soup)
+
+        for parser, same in checks.items():
+            passed &= same
+            print(f"{html_path.name[:27]:<28}{parser:<13}{'✅' if same else '❌'}")
+    return passed
+
+
+def make_synthetic_code_html(lines=10_000, lines_per_block=100):
+    """Html программистского гайда: только блоки кода по lines_per_block строк с отступами и пустыми строками"""
+    parts = []
+    for block in range(lines // lines_per_block):
+        parts.append(f'<p class="c3"><span class="c5">START_CODE_SECTION</span></p>')
+        for line in range(lines_per_block):
+            indent = f' style="margin-left:{18 * (line % 4)}pt"' if line % 4 else ''
+            parts.append(f'<p class="c6"{indent}><span class="c8">val x{line} = mapOf(&quot;k&quot; to {block})'
+                         f'&nbsp;// a &lt; b &amp;&amp; c &gt; d</span></p>')
+            if line % 10 == 9:
+                parts.append('\n')
+        parts.append('<p class="c3"><span class="c5">END_CODE_SECTION</span></p>')
+    return '<html><head></head><body>' + ''.join(parts) + '</body></html>'
+
+
+def bench_code_blocks(lines=10_000):
+    """
+    Обработка блоков кода на документе из lines строк кода. Отдельно сравнивается очистка строк:
+    прежний разбор каждой строки BeautifulSoup и быстрый путь (текстовые узлы + html.unescape)
+    """
+    from bs4 import BeautifulSoup
+    from zip_postprocessor.html_processing.code_blocks import process_code_sections, _strip_tags
+    from zip_postprocessor.utils.html_parser import parse_html
+
+    soup = parse_html(make_synthetic_code_html(lines))
+    serialized_lines = [line for p in soup.find_all('p') for line in str(p).split('\n')]
+
+    started = time.perf_counter()
+    legacy = [BeautifulSoup(line, 'html.parser').get_text() for line in serialized_lines]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    fast = [_strip_tags(line) for line in serialized_lines]
+    fast_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    process_code_sections(soup)
+    total_time = time.perf_counter() - started
+
+    print(f"\n🧾 Строк кода: {lines}")
+    print(f"Очистка строк: BeautifulSoup на строку {legacy_time * 1000:.0f} мс, "
+          f"быстрый путь {fast_time * 1000:.0f} мс ({legacy_time / fast_time:.0f}x)")
+    if legacy != fast:
+        print("❌ Быстрая очистка строк отличается от BeautifulSoup!")
+    print(f"process_code_sections целиком: {total_time * 1000:.0f} мс")
+
+
+def bench_code_block_modes(html_paths=()):
+    """
+    Размер html и число элементов при построчной и компактной разметке блоков кода.
+    html_paths — html гайдов (экспорт до постобработки); без них берётся синтетический гайд
+    """
+    from constants import CODE_BLOCK_LINES, CODE_BLOCK_COMPACT
+    from zip_postprocessor.html_processing.code_blocks import process_code_sections
+    from zip_postprocessor.utils.html_parser import parse_html
+
+    guides = {Path(path).name: Path(path).read_text(encoding='utf-8') for path in html_paths}
+    if not guides:
+        guides["synthetic"] = make_synthetic_code_html()
+
+    print(f"{'Гайд':<24}{'Режим':<10}{'Размер, КБ':>12}{'Элементов':>11}")
+    for name, html_content in guides.items():
+        sizes = {}
+        for mode in (CODE_BLOCK_LINES, CODE_BLOCK_COMPACT):
+            soup = parse_html(html_content)
+            process_code_sections(soup, mode)
+            sizes[mode] = len(str(soup).encode())
+            print(f"{name[:23]:<24}{mode:<10}{sizes[mode] / 1024:>12.0f}{len(soup.find_all(True)):>11}")
+        saved = 1 - sizes[CODE_BLOCK_COMPACT] / sizes[CODE_BLOCK_LINES]
+        print(f"{'':<24}экономия компактного режима: {saved:.0%}")
+
+
+def _measure(func, *args):
+    """(время, пиковая память) вызова; память — отдельным прогоном под tracemalloc, чтобы он не искажал время"""
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+
+    return elapsed, _peak_memory(func, *args)
+
+
+def bench_streaming_html(sections=1500):
+    """
+    Обработка большого html экспорта: дерево BeautifulSoup (html.parser) против потокового прохода.
+    Результаты обязаны совпадать байт в байт, потоковый проход не должен держать документ в памяти
+    """
+    from zip_postprocessor.archiver.prepare import prepare_html
+    from zip_postprocessor.html_processing.pipeline import HtmlDocument
+    from zip_postprocessor.html_processing.streaming import rewrite_html_from_zip
+    from zip_postprocessor.utils.archive import read_html_from_zip
+
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    zip_path = BENCH_DIR / "bench_export.zip"
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr("guide.html", make_synthetic_export_html(sections))
+    html_size = zipfile.ZipFile(zip_path).getinfo("guide.html").file_size
+
+    image_sources = {f"image{i}.png": f"image{i}.jpg" for i in range(1, 51, 2)}
+    variants = {f"image{i}": [Path(f"image{i}.avif"), Path(f"image{i}.webp")] for i in range(2, 51, 2)}
+    tree_path, stream_path = BENCH_DIR / "tree.html", BENCH_DIR / "stream.html"
+
+    def tree():
+        document = HtmlDocument(read_html_from_zip(zip_path), "html.parser")
+        prepare_html(tree_path, image_sources, variants, document)
+
+    results = {
+        "дерево": _measure(tree),
+        "поток": _measure(rewrite_html_from_zip, zip_path, stream_path, image_sources, variants),
+    }
+
+    print(f"\n📄 Html: {html_size / 2 ** 20:.1f} МБ")
+    print(f"{'Способ':<10}{'Время, с':>10}{'Пик памяти, МБ':>17}")
+    for label, (elapsed, peak) in results.items():
+        print(f"{label:<10}{elapsed:>10.2f}{peak / 2 ** 20:>17.1f}")
+    if tree_path.read_bytes() != stream_path.read_bytes():
+        print("❌ Потоковый результат отличается от дерева!")
+
+
+if __name__ == "__main__":
+    print("=== ⏱️  Бенчмарк перекодирования изображений ===")
+    bench_parallel_transcoding()
+    print("\n=== 💾 Бенчмарк памяти при пересборке docx ===")
+    passed = bench_streaming_memory()
+    print("\n=== 🧩 Бенчмарк парсеров html ===")
+    passed &= bench_html_parsers()
+    print("\n=== 🧾 Бенчмарк блоков кода ===")
+    bench_code_blocks()
+    print("\n=== 📏 Размер html при разной разметке блоков кода ===")
+    bench_code_block_modes(sys.argv[1:])
+    print("\n=== 🌊 Бенчмарк потоковой обработки html ===")
+    bench_streaming_html()
+    if not passed:
+        sys.exit(1)
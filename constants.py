@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 DEBUG_SERVER = "http://127.0.0.1:8000/"
@@ -22,3 +23,77 @@ def set_base_url(url: str):
 
 TEMP_DIR = Path("temp")
 TEMP_DIR.mkdir(exist_ok=True)
+
+# Количество процессов для перекодирования изображений из docx
+IMAGE_WORKERS = os.cpu_count() or 1
+
+# Размер блока при потоковом копировании больших записей docx
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Дисковый кэш перекодированных изображений, переживает очистку temp между запусками
+IMAGE_CACHE_DIR = Path("cache") / "images"
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Во сколько раз картинка больше своего размера в документе (device pixel ratio), None — не уменьшать
+IMAGE_DPR = 2
+
+# WebP/AVIF-версии картинок для <picture> (опционально): подпапка в папке картинок и флаг включения
+IMAGE_VARIANTS_DIR = "variants"
+MODERN_IMAGE_FORMATS = False
+
+# Google Drive: лимит размера docx для импорта в Google Docs и размер, до которого стоит ужимать копию
+DRIVE_IMPORT_LIMIT = 50 * 1024 * 1024
+DRIVE_TARGET_SIZE = 10 * 1024 * 1024
+
+# Кэш результатов конвертации Google Drive (zip с html) по хэшу отправленного docx
+CONVERSION_CACHE_DIR = Path("cache") / "conversions"
+CONVERSION_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+CONVERSION_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Передача файлов в Google Drive по частям: размер части (кратен 256 КБ) и число повторов одной части
+DRIVE_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+DRIVE_DOWNLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+DRIVE_CHUNK_RETRIES = 5
+
+# Забытые временные документы в Google Drive старше этого возраста (сек) удаляет очистка при запуске
+DRIVE_ORPHAN_MIN_AGE = 60 * 60
+# Сколько секунд при выходе из программы ждать фоновые удаления временных документов; остальные уберёт очистка
+DRIVE_DELETE_EXIT_TIMEOUT = 10
+
+# Пакетная конвертация: параллельные конвертации и ограничение частоты запросов к Drive.
+# Квота Drive — 12 000 запросов в минуту на пользователя, но создание документов стабильно
+# проходит лишь на ~3 запросах в секунду, чаще начинаются 403 rateLimitExceeded
+DRIVE_BATCH_WORKERS = 4
+DRIVE_REQUESTS_PER_SECOND = 3
+DRIVE_REQUESTS_BURST = 10
+# Пакетная конвертация пишет zip каждого документа в свою подпапку: одноимённые docx из разных папок не пересекаются
+BATCH_OUTPUT_DIR = TEMP_DIR / "batch"
+
+# Движок конвертации docx в html: Google Drive или локальный офлайн-движок (docx_html_engine)
+DRIVE_BACKEND = "drive"
+LOCAL_BACKEND = "local"
+CONVERTER_BACKEND = DRIVE_BACKEND
+
+# Парсер html для постобработки: "lxml" (быстрый), "html5lib" или встроенный "html.parser".
+# Если библиотека парсера не установлена, используется html.parser.
+# lxml и html5lib не знают номеров строк: ошибку маркеров кода с номером строки html даёт повторный разбор html.parser
+HTML_PARSER = "lxml"
+
+# Html экспорта больше этого размера обрабатывается потоково (без дерева в памяти) —
+# результат как у дерева с html.parser; размер куска при чтении html из архива (символов)
+STREAMING_HTML_MIN_BYTES = 50 * 1024 * 1024
+STREAMING_HTML_CHUNK_CHARS = 1024 * 1024
+
+# Разметка блоков кода: "lines" — div.line > code на каждую строку,
+# "compact" — один <pre><code> на блок, строки — <span>, номера строк рисует CSS-счётчик (вдвое меньше элементов)
+CODE_BLOCK_LINES = "lines"
+CODE_BLOCK_COMPACT = "compact"
+CODE_BLOCK_MODE = CODE_BLOCK_LINES
+
+# Подсветка синтаксиса блоков кода при сборке (нужен Pygments; без него блоки остаются без подсветки).
+# Язык берётся из маркера (START_CODE_SECTION:python); блоки без него подсвечивает highlight.js на странице.
+# Классы токенов — короткие классы Pygments с префиксом, чтобы не совпасть с классами c1, c2... экспорта Google
+CODE_HIGHLIGHT = False
+CODE_HIGHLIGHT_CLASS_PREFIX = "hl-"
+# Стиль Pygments, из которого собраны правила .hl-* в test/style.css: токены без правила в нём выводятся без <span>
+CODE_HIGHLIGHT_STYLE = "default"
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DiskCache:
+    """
+    Дисковый кэш "ключ — файл". Ключ строится из хэша исходных данных и параметров обработки.
+    Время последнего использования хранится в atime файла (LRU), время создания — в mtime (TTL).
+    При переполнении удаляются давно не использованные записи, устаревшие — всегда.
+    """
+
+    def __init__(self, cache_dir, max_bytes, ttl=None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def source_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def file_hash(path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(source_hash: str, *params) -> str:
+        """Ключ записи: хэш исходника + параметры обработки (формат, качество, ограничение размера...)"""
+        return "_".join([source_hash, *(str(param) for param in params)])
+
+    def _lookup(self, key: str):
+        """Путь к живой записи или None; попадание обновляет время использования"""
+        path = self.cache_dir / key
+        try:
+            stat = path.stat()
+        except OSError:
+            self.misses += 1
+            return None
+
+        if self._expired(stat):
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+        os.utime(path, (time.time(), stat.st_mtime))
+        self.hits += 1
+        return path
+
+    def _expired(self, stat):
+        return self.ttl is not None and time.time() - stat.st_mtime > self.ttl
+
+    def get(self, key: str):
+        path = self._lookup(key)
+        try:
+            return path.read_bytes() if path else None
+        except OSError:
+            return None
+
+    def get_file(self, key: str, target_path) -> bool:
+        """Копирует запись в target_path, не загружая её в память; False — записи нет"""
+        path = self._lookup(key)
+        if not path:
+            return False
+        shutil.copyfile(path, target_path)
+        return True
+
+    def put(self, key: str, data: bytes):
+        tmp_path = self.cache_dir / f"{key}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.cache_dir / key)
+
+    def put_file(self, key: str, source_path):
+        tmp_path = self.cache_dir / f"{key}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, self.cache_dir / key)
+
+    def evict(self):
+        """Удаляет устаревшие записи и самые давно использованные, пока кэш не уложится в max_bytes"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                # запись уже удалена параллельной очисткой
+                continue
+            if self._expired(stat):
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,274 @@
+import html
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from docx_optimizer import DOCUMENT_XML, DOCUMENT_RELS, EXTENT_TAG, BLIP_TAG, EMBED_ATTR, EMU_PER_PX, \
+    relationship_path
+
+STYLES_XML = "word/styles.xml"
+NUMBERING_XML = "word/numbering.xml"
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R_ID_ATTR = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+DRAWING_TAG = W_NS + "drawing"
+VAL_ATTR = W_NS + "val"
+
+# в docx отступы заданы в twips (1/20 пункта)
+TWIPS_PER_PT = 20
+# имена встроенных стилей заголовков в styles.xml не локализуются: "heading 1".."heading 6", "Title"
+HEADING_STYLE = re.compile(r'^heading ([1-6])$', re.IGNORECASE)
+TITLE_STYLE = "title"
+
+ALIGNMENTS = {"center": "center", "right": "right", "end": "right", "both": "justify"}
+# форматирование run'а: тег docx -> html-тег
+RUN_FORMATS = ((W_NS + "b", "strong"), (W_NS + "i", "em"), (W_NS + "u", "u"), (W_NS + "strike", "s"))
+# контейнеры, содержимое которых выводится как обычный текст абзаца
+INLINE_CONTAINERS = (W_NS + "ins", W_NS + "smartTag", W_NS + "fldSimple", W_NS + "sdt", W_NS + "sdtContent")
+
+HTML_TEMPLATE = ('<html><head><meta content="text/html; charset=UTF-8" http-equiv="content-type">'
+                 '<title>{title}</title></head><body>{body}</body></html>')
+
+
+def convert_docx_to_html_zip(word_path, output_zip, original_name):
+    """
+    Конвертирует docx в zip той же раскладки, что и экспорт Google Docs: {original_name}.html и images/.
+    Картинки в html ссылаются на файлы под их именами из word/media (в порядке появления в тексте),
+    сами файлы кладутся в images/ без изменений.
+    """
+    with zipfile.ZipFile(word_path) as docx_zip:
+        builder = _HtmlBuilder(
+            _read_relationships(docx_zip),
+            _read_heading_styles(docx_zip),
+            _read_bullet_lists(docx_zip)
+        )
+        with docx_zip.open(DOCUMENT_XML) as document:
+            body = ElementTree.parse(document).getroot().find(W_NS + "body")
+        body_html = builder.blocks(body) if body is not None else ""
+
+        with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as output:
+            output.writestr(f"{original_name}.html",
+                            HTML_TEMPLATE.format(title=html.escape(original_name), body=body_html))
+            for filename in builder.media:
+                output.writestr(f"images/{posixpath.basename(filename)}", docx_zip.read(filename))
+
+
+def _read_relationships(docx_zip):
+    """{rId: (цель, внешняя ли ссылка)}; внутренние цели — полные пути в архиве"""
+    try:
+        with docx_zip.open(DOCUMENT_RELS) as rels_file:
+            relationships = ElementTree.parse(rels_file).getroot()
+    except KeyError:
+        return {}
+
+    targets = {}
+    for rel in relationships:
+        target = rel.get('Target', '')
+        if rel.get('TargetMode') == 'External':
+            targets[rel.get('Id')] = (target, True)
+        else:
+            targets[rel.get('Id')] = (relationship_path(target), False)
+    return targets
+
+
+def _read_heading_styles(docx_zip):
+    """{styleId: уровень заголовка}; styleId в локализованном Word бывает любым ("1", "Heading1"...)"""
+    try:
+        with docx_zip.open(STYLES_XML) as styles_file:
+            styles = ElementTree.parse(styles_file).getroot()
+    except KeyError:
+        return {}
+
+    levels = {}
+    for style in styles.iter(W_NS + "style"):
+        name = style.find(W_NS + "name")
+        if name is None:
+            continue
+        style_name = name.get(VAL_ATTR, '')
+        match = HEADING_STYLE.match(style_name)
+        if match:
+            levels[style.get(W_NS + "styleId")] = int(match.group(1))
+        elif style_name.lower() == TITLE_STYLE:
+            levels[style.get(W_NS + "styleId")] = 1
+    return levels
+
+
+def _read_bullet_lists(docx_zip):
+    """Множество (numId, ilvl) маркированных списков; остальные списки — нумерованные"""
+    try:
+        with docx_zip.open(NUMBERING_XML) as numbering_file:
+            numbering = ElementTree.parse(numbering_file).getroot()
+    except KeyError:
+        return set()
+
+    bullet_levels = {}
+    for abstract in numbering.iter(W_NS + "abstractNum"):
+        bullet_levels[abstract.get(W_NS + "abstractNumId")] = {
+            level.get(W_NS + "ilvl")
+            for level in abstract.iter(W_NS + "lvl")
+            if _child_val(level, "numFmt") == "bullet"
+        }
+
+    bullets = set()
+    for num in numbering.iter(W_NS + "num"):
+        abstract_id = _child_val(num, "abstractNumId")
+        for ilvl in bullet_levels.get(abstract_id, ()):
+            bullets.add((num.get(W_NS + "numId"), ilvl))
+    return bullets
+
+
+def _child_val(element, tag):
+    child = element.find(W_NS + tag) if element is not None else None
+    return child.get(VAL_ATTR) if child is not None else None
+
+
+def _is_on(element, tag):
+    """Включён ли флаг форматирования (<w:b/>, <w:b w:val="1"/>; но не <w:b w:val="0"/>)"""
+    child = element.find(tag) if element is not None else None
+    return child is not None and child.get(VAL_ATTR, 'true') not in ('0', 'false', 'off')
+
+
+class _HtmlBuilder:
+    """Собирает html из тела документа и запоминает использованные картинки (в порядке появления)"""
+
+    def __init__(self, relationships, heading_levels, bullet_lists):
+        self.relationships = relationships
+        self.heading_levels = heading_levels
+        self.bullet_lists = bullet_lists
+        # упорядоченное множество путей картинок в архиве docx
+        self.media = {}
+
+    def blocks(self, container):
+        """Абзацы, таблицы и списки контейнера (тело документа, ячейка таблицы)"""
+        parts = []
+        open_list = None
+        for element in container:
+            list_tag = self._list_tag(element) if element.tag == W_NS + "p" else None
+            if open_list and list_tag != open_list:
+                parts.append(f"</{open_list}>")
+                open_list = None
+            if list_tag and not open_list:
+                parts.append(f"<{list_tag}>")
+                open_list = list_tag
+
+            if element.tag == W_NS + "p":
+                parts.append(self.paragraph(element, in_list=bool(list_tag)))
+            elif element.tag == W_NS + "tbl":
+                parts.append(self.table(element))
+            elif element.tag == W_NS + "sdt":
+                content = element.find(W_NS + "sdtContent")
+                if content is not None:
+                    parts.append(self.blocks(content))
+
+        if open_list:
+            parts.append(f"</{open_list}>")
+        return "".join(parts)
+
+    def _list_tag(self, paragraph):
+        num_pr = paragraph.find(f"{W_NS}pPr/{W_NS}numPr")
+        num_id = _child_val(num_pr, "numId")
+        if not num_id or num_id == "0":
+            return None
+        return "ul" if (num_id, _child_val(num_pr, "ilvl") or "0") in self.bullet_lists else "ol"
+
+    def paragraph(self, paragraph, in_list=False):
+        properties = paragraph.find(W_NS + "pPr")
+        inner = self.inline(paragraph)
+
+        if in_list:
+            level = int(_child_val(properties.find(W_NS + "numPr"), "ilvl") or 0)
+            style = f' style="margin-left:{level * 36}pt"' if level else ''
+            return f"<li{style}>{inner}</li>"
+
+        heading = self.heading_levels.get(_child_val(properties, "pStyle"))
+        tag = f"h{heading}" if heading else "p"
+        style = self._paragraph_style(properties)
+        return f"<{tag}{style}>{inner}</{tag}>"
+
+    @staticmethod
+    def _paragraph_style(properties):
+        """Отступы и выравнивание; отступы в pt — их читает обработка блоков кода (style_parser)"""
+        if properties is None:
+            return ""
+        styles = []
+        indent = properties.find(W_NS + "ind")
+        if indent is not None:
+            left = indent.get(W_NS + "left") or indent.get(W_NS + "start")
+            if left and int(left):
+                styles.append(f"margin-left:{int(left) / TWIPS_PER_PT:g}pt")
+            first_line = indent.get(W_NS + "firstLine")
+            hanging = indent.get(W_NS + "hanging")
+            if first_line and int(first_line):
+                styles.append(f"text-indent:{int(first_line) / TWIPS_PER_PT:g}pt")
+            elif hanging and int(hanging):
+                styles.append(f"text-indent:-{int(hanging) / TWIPS_PER_PT:g}pt")
+        alignment = ALIGNMENTS.get(_child_val(properties, "jc"))
+        if alignment:
+            styles.append(f"text-align:{alignment}")
+        return f' style="{";".join(styles)}"' if styles else ""
+
+    def inline(self, element):
+        """Текст абзаца: run'ы, ссылки и прозрачные контейнеры (правки, смарт-теги, поля)"""
+        parts = []
+        for child in element:
+            if child.tag == W_NS + "r":
+                parts.append(self.run(child))
+            elif child.tag == W_NS + "hyperlink":
+                parts.append(self.hyperlink(child))
+            elif child.tag in INLINE_CONTAINERS:
+                parts.append(self.inline(child))
+        return "".join(parts)
+
+    def hyperlink(self, element):
+        inner = self.inline(element)
+        target, external = self.relationships.get(element.get(R_ID_ATTR), (None, False))
+        if external:
+            href = target
+        elif element.get(W_NS + "anchor"):
+            href = "#" + element.get(W_NS + "anchor")
+        else:
+            return inner
+        return f'<a href="{html.escape(href)}">{inner}</a>'
+
+    def run(self, run):
+        parts = []
+        for child in run:
+            if child.tag == W_NS + "t":
+                parts.append(html.escape(child.text or "", quote=False))
+            elif child.tag == W_NS + "tab":
+                parts.append("\t")
+            elif child.tag in (W_NS + "br", W_NS + "cr"):
+                parts.append("<br>")
+            elif child.tag == W_NS + "noBreakHyphen":
+                parts.append("-")
+            elif child.tag == DRAWING_TAG:
+                parts.append(self.image(child))
+        text = "".join(parts)
+
+        properties = run.find(W_NS + "rPr")
+        for docx_tag, html_tag in RUN_FORMATS:
+            if text and _is_on(properties, docx_tag):
+                text = f"<{html_tag}>{text}</{html_tag}>"
+        return text
+
+    def image(self, drawing):
+        blip = drawing.find(f".//{BLIP_TAG}")
+        target, external = self.relationships.get(blip.get(EMBED_ATTR) if blip is not None else None, (None, True))
+        if external:
+            return ""
+        self.media[target] = True
+
+        style = ""
+        extent = drawing.find(f".//{EXTENT_TAG}")
+        if extent is not None:
+            width, height = (int(extent.get(side, 0)) / EMU_PER_PX for side in ('cx', 'cy'))
+            style = f' style="width: {width:.2f}px; height: {height:.2f}px;"'
+        return f'<img alt="" src="images/{posixpath.basename(target)}"{style}>'
+
+    def table(self, table):
+        rows = []
+        for row in table.findall(W_NS + "tr"):
+            cells = "".join(f"<td>{self.blocks(cell)}</td>" for cell in row.findall(W_NS + "tc"))
+            rows.append(f"<tr>{cells}</tr>")
+        return f"<table><tbody>{''.join(rows)}</tbody></table>"
@@ -1,12 +1,74 @@
+import contextlib
+import copy
+import hashlib
 import io
+import math
+import os
+import posixpath
+import shutil
+import struct
 import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import Enum
 from pathlib import Path
 from tkinter import Tk
+from typing import Dict, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
 from tkinter import filedialog
 
-from PIL import Image
+from PIL import Image, ImageFilter, features
 
-from constants import TEMP_DIR
+from constants import TEMP_DIR, IMAGE_WORKERS, COPY_CHUNK_SIZE, IMAGE_DPR, IMAGE_VARIANTS_DIR, DRIVE_TARGET_SIZE, \
+    DRIVE_IMPORT_LIMIT
+from image_cache import ImageCache
+
+_MASK_ENCRYPTED = 0x01
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+
+DOCUMENT_XML = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+WP_NS = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}"
+EXTENT_TAG = WP_NS + "extent"
+DRAWING_TAGS = (WP_NS + "inline", WP_NS + "anchor")
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+BLIP_TAG = A_NS + "blip"
+SRC_RECT_TAG = A_NS + "srcRect"
+BLIP_FILL_TAGS = ("{http://schemas.openxmlformats.org/drawingml/2006/picture}blipFill", A_NS + "blipFill")
+EMBED_ATTR = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+# 914400 EMU в дюйме, 96 CSS-пикселей в дюйме
+EMU_PER_PX = 9525
+# обрезка в a:srcRect задаётся в тысячных долях процента: 100000 — вся сторона картинки
+CROP_SCALE = 100000
+
+# Классификатор формата: сторона уменьшенной копии, порог цветов для палитры, доля самого частого цвета (фона),
+# порог яркости границы и доля граничных пикселей, выше которой картинка считается "резкой"
+AUTO_FORMAT = 'AUTO'
+CLASSIFY_SIDE = 256
+PALETTE_COLORS = 256
+FLAT_SHARE_THRESHOLD = 0.25
+EDGE_THRESHOLD = 48
+EDGE_DENSITY_THRESHOLD = 0.08
+
+# Дополнительные форматы для <picture>, в порядке предпочтения
+VARIANT_FORMATS = ('AVIF', 'WEBP')
+
+# Примерная доля, которая остаётся от картинки после JPEG с минимальным качеством
+COMPRESSED_SIZE_RATIO = 0.05
+
+# Версия перекодирования в ключе кэша картинок: растёт, когда при тех же параметрах меняется результат
+TRANSCODE_VERSION = 2
+
+PLACEHOLDER_SIDE = 16
+PLACEHOLDER_COLOR = (200, 200, 200)
+
+
+class DriveImageMode(Enum):
+    """Что делать с картинками в копии docx, которая уходит в Google Drive"""
+    COMPRESS = "compress"  # JPEG с минимальным качеством в исходном разрешении
+    PLACEHOLDER = "placeholder"  # крошечная заглушка с теми же пропорциями
+    ORIGINAL = "original"  # docx уходит как есть, без пересборки
+    AUTO = "auto"  # выбирается choose_drive_strategy по размеру docx
 
 
 def select_word_file() -> str:
@@ -24,86 +86,558 @@ def select_word_file() -> str:
     return file_path
 
 
-def extract_images_from_docx(docx_path, output_dir=TEMP_DIR / "images", jpeg_quality=60):
+def _save_variants(variants_dir, filename, result):
+    """Сохраняет WebP/AVIF-версии, которые меньше основной картинки и отличаются от неё форматом"""
+    if result.error or not result.variants:
+        return
+
+    web_extension = image_extension(result.web_data)
+    for data in result.variants.values():
+        extension = image_extension(data)
+        if extension != web_extension and len(data) < len(result.web_data):
+            (variants_dir / f"{Path(filename).stem}{extension}").write_bytes(data)
+
+
+def _finish_cache(cache):
+    if cache:
+        cache.evict()
+        cache.report()
+
+
+def choose_drive_strategy(docx_zip, file_size, target_size=DRIVE_TARGET_SIZE):
+    """
+    Выбирает наименьшую работу, после которой копия docx для Google Drive уложится в target_size.
+    Оценка идёт по размерам из центрального каталога архива, без чтения картинок:
+    ORIGINAL — отправить docx как есть, COMPRESS — сжать только самые крупные картинки,
+    PLACEHOLDER — даже сжатия всех картинок мало, ставим заглушки.
+    Возвращает (режим, имена картинок для обработки), None вместо имён — все картинки.
+    """
+    if file_size <= target_size:
+        print(f"🚀 Docx {file_size / 2 ** 20:.1f} МБ укладывается в {target_size / 2 ** 20:.0f} МБ — "
+              f"отправляем в Google Drive без пересборки")
+        return DriveImageMode.ORIGINAL, set()
+
+    images = sorted((item for item in docx_zip.infolist() if _is_compressible(item.filename)),
+                    key=lambda item: item.compress_size, reverse=True)
+    projected_size = file_size
+    selected = set()
+    for item in images:
+        projected_size -= item.compress_size * (1 - COMPRESSED_SIZE_RATIO)
+        selected.add(item.filename)
+        if projected_size <= target_size:
+            print(f"🗜️ Сжимаем {len(selected)} из {len(images)} самых крупных картинок для Google Drive")
+            return DriveImageMode.COMPRESS, selected
+
+    without_images = file_size - sum(item.compress_size for item in images)
+    if without_images > DRIVE_IMPORT_LIMIT:
+        print(f"⚠ Даже без картинок docx весит {without_images / 2 ** 20:.1f} МБ — "
+              f"больше лимита импорта Google Drive ({DRIVE_IMPORT_LIMIT / 2 ** 20:.0f} МБ)")
+    print("🗜️ Сжатия картинок недостаточно — в копию для Google Drive идут заглушки")
+    return DriveImageMode.PLACEHOLDER, None
+
+
+def _is_drive_target(filename, selected):
+    """Нужно ли подменять картинку в копии для Google Drive (selected = None — все картинки)"""
+    return _is_compressible(filename) and (selected is None or filename in selected)
+
+
+def _is_media(filename):
+    return filename.startswith("word/media/")
+
+
+def _is_compressible(filename):
+    return _is_media(filename) and filename.lower().endswith(('.png', '.jpeg', '.jpg'))
+
+
+def find_duplicate_media(docx_zip, media_items):
+    """
+    Ищет одинаковые по содержимому картинки из word/media.
+    Кандидаты отбираются по CRC и размеру из центрального каталога архива без чтения данных,
+    совпадение подтверждается sha256. Возвращает {имя дубликата: имя первого вхождения}.
+    """
+    candidates = {}
+    for item in media_items:
+        candidates.setdefault((item.CRC, item.file_size), []).append(item)
+
+    duplicates = {}
+    for group in candidates.values():
+        if len(group) < 2:
+            continue
+        originals = {}
+        for item in group:
+            digest = hashlib.sha256(docx_zip.read(item)).hexdigest()
+            original = originals.setdefault(digest, item.filename)
+            if original != item.filename:
+                duplicates[item.filename] = original
+    return duplicates
+
+
+def _make_job(docx_zip, item, web_quality, drive_quality, max_size=None, web_format='JPEG', variant_formats=()):
+    """
+    Готовит задачу для воркера. Сначала Pillow читает только заголовок файла:
+    видео и прочие не-картинки из word/media не загружаются в память целиком.
+    """
+    job = TranscodeJob(item.filename, None, web_quality, drive_quality, max_size, web_format,
+                       variant_formats=variant_formats)
+    try:
+        with docx_zip.open(item) as source:
+            Image.open(source)
+    except Exception as e:
+        return job._replace(error=str(e))
+    return job._replace(data=docx_zip.read(item))
+
+
+def relationship_path(target):
+    """Путь записи в архиве по Target связи из word/_rels: абсолютный — от корня архива, относительный — от word/"""
+    if target.startswith('/'):
+        return posixpath.normpath(target[1:])
+    return posixpath.normpath(posixpath.join('word', target))
+
+
+def read_display_sizes(docx_zip, dpr=IMAGE_DPR):
+    """
+    Размеры, в которых картинки показаны в документе: wp:extent из word/document.xml,
+    связанный через r:embed и word/_rels/document.xml.rels с файлом из word/media.
+    wp:extent — рамка уже обрезанной картинки, поэтому обрезка из a:srcRect возвращается обратно.
+    Возвращает {имя файла в архиве: (ширина, высота) в пикселях с учётом dpr}.
+    Если картинка встречается несколько раз, берётся наибольший размер.
+    """
+    try:
+        with docx_zip.open(DOCUMENT_RELS) as rels_file:
+            targets = {
+                rel.get('Id'): relationship_path(rel.get('Target', ''))
+                for rel in ElementTree.parse(rels_file).getroot()
+                if rel.get('TargetMode') != 'External'
+            }
+    except KeyError:
+        return {}
+
+    sizes = {}
+    extent = embed = None
+    crop = (0, 0)
+
+    def add_size():
+        if extent and embed in targets:
+            filename = targets[embed]
+            width, height = (math.ceil(emu * _uncrop_scale(cropped) / EMU_PER_PX * dpr)
+                             for emu, cropped in zip(extent, crop))
+            known_width, known_height = sizes.get(filename, (0, 0))
+            sizes[filename] = max(width, known_width), max(height, known_height)
+
+    with docx_zip.open(DOCUMENT_XML) as document:
+        for _, element in ElementTree.iterparse(document):
+            if element.tag == EXTENT_TAG:
+                extent = int(element.get('cx', 0)), int(element.get('cy', 0))
+            elif element.tag == BLIP_TAG:
+                add_size()
+                embed, crop = element.get(EMBED_ATTR), (0, 0)
+            elif element.tag == SRC_RECT_TAG:
+                crop = (int(element.get('l', 0)) + int(element.get('r', 0)),
+                        int(element.get('t', 0)) + int(element.get('b', 0)))
+            elif element.tag in BLIP_FILL_TAGS or element.tag in DRAWING_TAGS:
+                # a:srcRect идёт после a:blip, поэтому размер считается по закрытию blipFill (или всей картинки)
+                add_size()
+                embed, crop = None, (0, 0)
+                if element.tag in DRAWING_TAGS:
+                    extent = None
+            element.clear()
+
+    return {filename: size for filename, size in sizes.items() if all(size)}
+
+
+def _uncrop_scale(cropped):
+    """Во сколько раз вся сторона картинки больше видимой части; обрезка в 100% и больше не учитывается"""
+    visible = CROP_SCALE - cropped
+    return CROP_SCALE / visible if visible > 0 else 1
+
+
+def _write_entry(docx_zip, new_docx_zip, item, data=None, raw_copy=True):
+    """
+    Пишет запись в новый архив: новые данные целиком, иначе исходные.
+    В режиме raw_copy нетронутые записи копируются в сжатом виде, без распаковки и повторного сжатия,
+    без него — распаковываются и сжимаются заново, потоково, блоками.
+    """
+    # копия ZipInfo, чтобы запись не портила смещения исходного архива
+    new_item = copy.copy(item)
+    if data is not None:
+        new_docx_zip.writestr(new_item, data)
+        return
+
+    if raw_copy and not item.flag_bits & _MASK_ENCRYPTED:
+        _copy_raw_entry(docx_zip, new_docx_zip, new_item)
+        return
+
+    with docx_zip.open(item) as source, new_docx_zip.open(new_item, 'w') as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+
+
+def _copy_raw_entry(docx_zip, new_docx_zip, new_item):
+    """
+    Переносит сжатые байты записи из исходного архива как есть.
+    У zipfile нет публичного API для этого, поэтому используются его внутренние структуры:
+    заголовок записи пишется заново, а в центральный каталог она добавляется вручную.
+    """
+    source_offset = new_item.header_offset
+    zip64 = new_item.file_size > zipfile.ZIP64_LIMIT or new_item.compress_size > zipfile.ZIP64_LIMIT
+    # zip64-поле FileHeader добавит сам, размеры и CRC уже известны — дескриптор данных не нужен
+    new_item.extra = zipfile._strip_extra(new_item.extra, (1,))
+    new_item.flag_bits &= ~_MASK_USE_DATA_DESCRIPTOR
+
+    with docx_zip._lock:
+        source = docx_zip.fp
+        source.seek(source_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.read(zipfile.sizeFileHeader))
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Повреждён заголовок записи {new_item.filename}")
+        source.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+        target = new_docx_zip.fp
+        target.seek(new_docx_zip.start_dir)
+        new_item.header_offset = target.tell()
+        new_docx_zip._writecheck(new_item)
+        new_docx_zip._didModify = True
+        target.write(new_item.FileHeader(zip64))
+
+        remaining = new_item.compress_size
+        while remaining:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Запись {new_item.filename} обрывается раньше времени")
+            target.write(chunk)
+            remaining -= len(chunk)
+
+        new_docx_zip.start_dir = target.tell()
+        new_docx_zip.filelist.append(new_item)
+        new_docx_zip.NameToInfo[new_item.filename] = new_item
+
+
+def _make_placeholder(docx_zip, item):
+    """
+    Крошечная однотонная заглушка вместо картинки для копии docx в Google Drive.
+    Пропорции берутся из заголовка файла, пиксели исходника не декодируются.
+    Возвращает TranscodeResult, как и _transcode_image.
+    """
     try:
-        docx_path = Path(docx_path)
-        if not docx_path.exists():
-            print(f"❌ Файл {docx_path} не найден")
-            return None
+        with docx_zip.open(item) as source:
+            width, height = Image.open(source).size
+    except Exception as e:
+        return TranscodeResult(item.filename, error=str(e))
+
+    scale = PLACEHOLDER_SIDE / max(width, height)
+    size = max(1, round(width * scale)), max(1, round(height * scale))
+    image_format = 'PNG' if item.filename.lower().endswith('.png') else 'JPEG'
+
+    img_io = io.BytesIO()
+    Image.new('RGB', size, PLACEHOLDER_COLOR).save(img_io, format=image_format)
+    return TranscodeResult(item.filename, drive_data=img_io.getvalue())
+
+
+def _encode_jpeg(image, jpeg_quality):
+    """Кодирует уже декодированное изображение в JPEG и возвращает байты"""
+    img_io = io.BytesIO()
+    image.save(img_io, format='JPEG', quality=jpeg_quality)
+    return img_io.getvalue()
 
-        images_dir = Path(output_dir)
-        images_dir.mkdir(exist_ok=True)
 
-        found_images = []
+def choose_web_format(image):
+    """
+    Выбирает формат для сайта по уменьшенной копии картинки:
+    мало цветов и однотонный фон (скриншоты кода и интерфейса) — PNG с палитрой,
+    много резких границ (скриншоты со сглаживанием, схемы) — WebP,
+    остальное (фотографии) — JPEG.
+    """
+    # NEAREST не смешивает цвета, поэтому число цветов у копии не больше, чем у оригинала
+    scale = min(1.0, CLASSIFY_SIDE / max(image.size))
+    size = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    sample = image.resize(size, Image.Resampling.NEAREST).convert("RGB")
 
-        with zipfile.ZipFile(docx_path) as z:
-            for file_info in z.infolist():
-                if file_info.filename.startswith("word/media/"):
-                    found_images.append(file_info)
+    colors = sample.getcolors(PALETTE_COLORS)
+    # у скриншотов мало цветов и есть крупный однотонный фон; у ч/б фото цветов тоже мало, но фона нет
+    if colors is not None and max(colors)[0] >= FLAT_SHARE_THRESHOLD * sample.width * sample.height:
+        return 'PNG'
 
-            if not found_images:
-                print("ℹ️ В документе не найдено изображений.")
-                return None
+    histogram = sample.convert("L").filter(ImageFilter.FIND_EDGES).histogram()
+    edge_density = sum(histogram[EDGE_THRESHOLD:]) / (sample.width * sample.height)
+    if edge_density >= EDGE_DENSITY_THRESHOLD:
+        return 'WEBP' if features.check('webp') else 'PNG'
+    return 'JPEG'
+
+
+def _encode_web(image, web_format, quality):
+    """Кодирует картинку для сайта; web_format = AUTO_FORMAT — формат выбирается по содержимому"""
+    if web_format == AUTO_FORMAT:
+        web_format = choose_web_format(image)
+
+    if web_format == 'JPEG':
+        return _encode_jpeg(image, quality)
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    img_io = io.BytesIO()
+    if web_format == 'PNG':
+        image.quantize(PALETTE_COLORS).save(img_io, format='PNG', optimize=True)
+    else:
+        image.save(img_io, format=web_format, quality=quality)
+    return img_io.getvalue()
 
-            for file_info in found_images:
-                original_name = Path(file_info.filename).stem
-                jpeg_path = images_dir / f"{original_name}.jpg"
 
-                with z.open(file_info) as source:
-                    try:
-                        image = Image.open(source)
-                        if image.mode in ("RGBA", "P"):
-                            image = image.convert("RGB")
-                        image.save(jpeg_path, format="JPEG", quality=jpeg_quality)
-                    except Exception as e:
-                        print(f"⚠ Не удалось обработать {file_info.filename}: {e}")
+def image_extension(data):
+    """Расширение файла по сигнатуре закодированной картинки"""
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return '.avif'
+    return '.jpg'
 
-        print(f"📸 Все изображения сохранены в: {images_dir.resolve()}")
-        return images_dir
 
+def available_variant_formats():
+    """Современные форматы для <picture>, которые умеет кодировать установленный Pillow"""
+    return tuple(image_format for image_format in VARIANT_FORMATS if features.check(image_format.lower()))
+
+
+class TranscodeJob(NamedTuple):
+    """
+    Задача для воркера. None в качестве качества — вариант не нужен,
+    max_size — (ширина, высота), в которые надо вписать картинку, None — оставить как есть,
+    web_format — формат для сайта ('JPEG' или AUTO_FORMAT),
+    variant_formats — дополнительные форматы для сайта (WEBP, AVIF) с тем же качеством.
+    """
+    filename: str
+    data: Optional[bytes]
+    web_quality: Optional[int]
+    drive_quality: Optional[int]
+    max_size: Optional[Tuple[int, int]] = None
+    web_format: str = 'JPEG'
+    error: Optional[str] = None
+    variant_formats: Tuple[str, ...] = ()
+
+
+class TranscodeResult(NamedTuple):
+    """Результат задачи: variants — {формат: байты} для дополнительных форматов"""
+    filename: str
+    web_data: Optional[bytes] = None
+    drive_data: Optional[bytes] = None
+    error: Optional[str] = None
+    variants: Optional[Dict[str, bytes]] = None
+
+
+def _transcode_image(job):
+    """
+    Задача для воркера: декодирует изображение один раз и кодирует нужные варианты.
+    Возвращает TranscodeResult. Ничего не печатает — вывод делает главный процесс.
+    """
+    if job.error:
+        return TranscodeResult(job.filename, error=job.error)
+    try:
+        image = Image.open(io.BytesIO(job.data))
+        # палитру и 1-битные картинки Pillow уменьшает только ближайшим соседом (без сглаживания),
+        # поэтому они переводятся в RGB/L до thumbnail. JPEG таких режимов не бывает: он по-прежнему
+        # декодируется сразу в уменьшенном виде (draft внутри thumbnail)
+        if image.mode == "P":
+            image = image.convert("RGB")
+        elif image.mode == "1" and job.max_size:
+            image = image.convert("L")
+        if job.max_size:
+            # остальные форматы сначала грубо уменьшаются через reduce, полное разрешение не держим
+            image.thumbnail(job.max_size, Image.Resampling.LANCZOS)
+        if image.mode == "RGBA":
+            image = image.convert("RGB")
+
+        web_data = _encode_web(image, job.web_format, job.web_quality) if job.web_quality is not None else None
+        drive_data = _encode_jpeg(image, job.drive_quality) if job.drive_quality is not None else None
+        variants = {image_format: _encode_web(image, image_format, job.web_quality)
+                    for image_format in job.variant_formats}
+        return TranscodeResult(job.filename, web_data, drive_data, variants=variants)
     except Exception as e:
-        print(f"❌ Произошла ошибка: {e}")
-        return None
-
-
-def compress_images_in_docx(input_path, jpeg_quality=1):
-    input_path = Path(input_path)
-    if not input_path.exists():
-        print(f"❌ Файл {input_path} не найден")
-        return None
-
-    output_path = TEMP_DIR / f"{input_path.stem}.docx"
-
-    image_found = False
-
-    with zipfile.ZipFile(input_path, 'r') as docx_zip:
-        new_docx_io = io.BytesIO()
-        with zipfile.ZipFile(new_docx_io, 'w') as new_docx_zip:
-            for item in docx_zip.infolist():
-                data = docx_zip.read(item.filename)
-
-                if item.filename.startswith('word/media/') and item.filename.lower().endswith(
-                        ('.png', '.jpeg', '.jpg')):
-                    image_found = True
-                    try:
-                        image = Image.open(io.BytesIO(data))
-                        img_io = io.BytesIO()
-                        if image.mode in ("RGBA", "P"):
-                            image = image.convert("RGB")
-                        image.save(img_io, format='JPEG', quality=jpeg_quality)
-                        img_io.seek(0)
-                        data = img_io.read()
-                    except Exception as e:
-                        print(f"⚠ Не удалось обработать {item.filename}: {e}")
-
-                new_docx_zip.writestr(item, data)
-
-    with open(output_path, 'wb') as f:
-        f.write(new_docx_io.getvalue())
-
-    if not image_found:
-        print("ℹ️ В документе не найдено изображений. Сжатие не требуется.")
+        return TranscodeResult(job.filename, error=str(e))
+
+
+def transcode_images(jobs, workers=IMAGE_WORKERS, cache=None):
+    """
+    Перекодирует изображения в пуле процессов. jobs может быть ленивым генератором:
+    одновременно в памяти держится не больше workers * 2 исходных изображений.
+    Результаты отдаются строго в порядке jobs, поэтому имена и содержимое файлов
+    не зависят от количества воркеров.
+    Если передан cache (ImageCache), уже закодированные варианты берутся из него без Pillow.
+    """
+    workers = max(1, workers or 1)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(_submit_job(executor, job, cache))
+            if len(pending) >= workers * 2:
+                yield _collect_job(*pending.popleft(), cache)
+        while pending:
+            yield _collect_job(*pending.popleft(), cache)
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def _job_outputs(job):
+    """Все варианты, которые нужны от задачи: [(слот в результате, формат, качество)]"""
+    outputs = []
+    if job.web_quality is not None:
+        outputs.append(('web', job.web_format, job.web_quality))
+        outputs.extend((image_format, image_format, job.web_quality) for image_format in job.variant_formats)
+    if job.drive_quality is not None:
+        outputs.append(('drive', 'JPEG', job.drive_quality))
+    return outputs
+
+
+def _submit_job(executor, job, cache):
+    """Отдаёт воркеру только те варианты, которых нет в кэше"""
+    keys, cached = {}, {}
+
+    if cache and not job.error:
+        source_hash = cache.source_hash(job.data)
+        size_param = "x".join(map(str, job.max_size)) if job.max_size else "full"
+        for slot, image_format, quality in _job_outputs(job):
+            keys[slot] = cache.make_key(source_hash, image_format, quality, size_param, f"v{TRANSCODE_VERSION}")
+            cached_data = cache.get(keys[slot])
+            if cached_data is not None:
+                cached[slot] = cached_data
+
+        job = job._replace(
+            web_quality=None if 'web' in cached and all(f in cached for f in job.variant_formats) else job.web_quality,
+            variant_formats=tuple(f for f in job.variant_formats if f not in cached),
+            drive_quality=None if 'drive' in cached else job.drive_quality,
+        )
+        if not _job_outputs(job):
+            # всё нашлось в кэше — Pillow не нужен
+            job = job._replace(data=None)
+
+    if executor and job.data is not None:
+        future = executor.submit(_transcode_image, job)
     else:
-        print(f"📦 Сжатие завершено. Сохранено в: {output_path.resolve()}")
+        future = Future()
+        future.set_result(_transcode_image(job) if job.data is not None or job.error
+                          else TranscodeResult(job.filename))
+
+    return future, keys, cached
+
+
+def _collect_job(future, keys, cached, cache):
+    result = future.result()
+    if result.error:
+        return result
+
+    encoded = {'web': result.web_data, 'drive': result.drive_data, **(result.variants or {})}
+    for slot, key in keys.items():
+        if slot not in cached and encoded.get(slot) is not None:
+            cache.put(key, encoded[slot])
+    encoded.update(cached)
+
+    variants = {slot: data for slot, data in encoded.items() if slot not in ('web', 'drive') and data is not None}
+    return TranscodeResult(result.filename, encoded['web'], encoded['drive'], variants=variants)
+
 
-    return output_path
+def process_docx_images(docx_path, output_dir=TEMP_DIR / "images", web_quality=60, drive_quality=1,
+                        workers=IMAGE_WORKERS, raw_copy=True, use_cache=True, dpr=IMAGE_DPR,
+                        drive_mode=DriveImageMode.COMPRESS, auto_format=False, modern_formats=False,
+                        target_size=DRIVE_TARGET_SIZE):
+    """
+    Один проход по docx: каждое изображение декодируется один раз, после чего из него
+    получаются и JPEG для сайта (output_dir), и сильно сжатая копия для Google Drive.
+    Декодирование и кодирование распределяются по workers процессам, а с use_cache
+    уже перекодированные раньше картинки берутся из дискового кэша. Новый docx
+    пишется сразу на диск, а нетронутые записи (raw_copy) переносятся без пересжатия.
+    Одинаковые картинки перекодируются один раз, результат переиспользуется для всех копий.
+    Картинки уменьшаются до размера, в котором показаны в документе, умноженного на dpr (None — не уменьшать).
+    drive_mode задаёт, что кладётся в копию для Google Drive: сжатый JPEG, крошечная заглушка,
+    исходный docx без пересборки или AUTO — наименьшая работа, чтобы уложиться в target_size.
+    С auto_format формат для сайта (PNG/JPEG/WebP) выбирается по содержимому картинки, иначе всегда JPEG.
+    С modern_formats рядом кладутся WebP/AVIF-версии (IMAGE_VARIANTS_DIR) для <picture>, если они меньше основной.
+    Возвращает (images_dir, compressed_path, duplicates), images_dir = None если изображений нет,
+    duplicates — {имя дубликата в images_dir: имя первого вхождения}.
+    """
+    docx_path = Path(docx_path)
+    if not docx_path.exists():
+        print(f"❌ Файл {docx_path} не найден")
+        return None, None, {}
+
+    images_dir = Path(output_dir)
+    images_dir.mkdir(exist_ok=True)
+    cache = ImageCache() if use_cache else None
+
+    with zipfile.ZipFile(docx_path, 'r') as docx_zip:
+        selected = None
+        if drive_mode == DriveImageMode.AUTO:
+            drive_mode, selected = choose_drive_strategy(docx_zip, docx_path.stat().st_size, target_size)
+        rewrite = drive_mode != DriveImageMode.ORIGINAL
+        output_path = TEMP_DIR / f"{docx_path.stem}.docx" if rewrite else docx_path
+
+        items = docx_zip.infolist()
+        media_items = [item for item in items if _is_media(item.filename)]
+        duplicates = find_duplicate_media(docx_zip, media_items)
+        shared_originals = set(duplicates.values())
+        shared_results = {}
+
+        display_sizes = read_display_sizes(docx_zip, dpr) if dpr else {}
+        for duplicate, original in duplicates.items():
+            # общий файл должен подойти для самого крупного из показов
+            if original in display_sizes and duplicate in display_sizes:
+                display_sizes[original] = tuple(map(max, display_sizes[original], display_sizes[duplicate]))
+            else:
+                display_sizes.pop(original, None)
+
+        placeholders = drive_mode == DriveImageMode.PLACEHOLDER
+        compress = drive_mode == DriveImageMode.COMPRESS
+        # дубликат сжимается вместе с оригиналом, даже если в список крупных попал только он сам
+        compressed = {duplicates.get(name, name) for name in selected} if selected is not None else None
+        variant_formats = available_variant_formats() if modern_formats else ()
+        variants_dir = images_dir / IMAGE_VARIANTS_DIR
+        if variant_formats:
+            variants_dir.mkdir(exist_ok=True)
+
+        jobs = (_make_job(docx_zip, item, web_quality,
+                          drive_quality if compress and _is_drive_target(item.filename, compressed) else None,
+                          display_sizes.get(item.filename), AUTO_FORMAT if auto_format else 'JPEG', variant_formats)
+                for item in media_items if item.filename not in duplicates)
+        local_names = {}
+        results = transcode_images(jobs, workers, cache)
+
+        with zipfile.ZipFile(output_path, 'w') if rewrite else contextlib.nullcontext() as new_docx_zip:
+            for item in items:
+                drive_data = None
+                if _is_media(item.filename):
+                    if item.filename in duplicates:
+                        result = shared_results[duplicates[item.filename]]
+                    else:
+                        result = next(results)
+                        if item.filename in shared_originals:
+                            shared_results[item.filename] = result
+                        # у дубликатов своих вариантов нет: html ссылается на оригинал
+                        _save_variants(variants_dir, item.filename, result)
+
+                    if _is_drive_target(item.filename, selected):
+                        drive_data = result.drive_data
+                        if placeholders and not result.error:
+                            # id связей и порядок записей не меняются — подменяется только содержимое файла
+                            drive_data = _make_placeholder(docx_zip, item).drive_data
+
+                    if result.error:
+                        print(f"⚠ Не удалось обработать {item.filename}: {result.error}")
+                    else:
+                        local_names[item.filename] = Path(item.filename).stem + image_extension(result.web_data)
+                        (images_dir / local_names[item.filename]).write_bytes(result.web_data)
+                if rewrite:
+                    _write_entry(docx_zip, new_docx_zip, item, drive_data, raw_copy)
+
+    _finish_cache(cache)
+    if not media_items:
+        print("ℹ️ В документе не найдено изображений.")
+        return None, output_path, {}
+
+    if duplicates:
+        print(f"♻️ Повторяющихся изображений: {len(duplicates)}, перекодированы один раз")
+    print(f"📸 Все изображения сохранены в: {images_dir.resolve()}")
+    if rewrite:
+        print(f"📦 Сжатие завершено. Сохранено в: {output_path.resolve()}")
+    return images_dir, output_path, {local_names[duplicate]: local_names[original]
+                                     for duplicate, original in duplicates.items()
+                                     if duplicate in local_names and original in local_names}
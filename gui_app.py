@@ -1,9 +1,10 @@
 import io
+import multiprocessing
 import sys
 import threading
 import tkinter as tk
 from tkinter import messagebox
-from typing import Dict, Callable
+from typing import Dict, Callable, Optional
 
 import customtkinter as ctk
 
@@ -11,6 +12,7 @@ import constants
 from main import mainAction
 from upload_manager.level_cache import save_last_level, load_next_order
 from utils import Status
+from word_to_html_converter import UPLOAD_STAGE
 
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("blue")
@@ -77,6 +79,14 @@ class ModernGuideUploaderApp:
         progress_value = list(Status).index(status) / (len(Status) - 1)
         self.progress_bar.set(progress_value)
 
+    def show_transfer_progress(self, stage: str, done: int, total: Optional[int]):
+        """Прогресс передачи файла в/из Google Drive (progress_callback конвертера)"""
+        action = "Загрузка в Google Drive" if stage == UPLOAD_STAGE else "Скачивание HTML"
+        description = f"{action}: {done / 2 ** 20:.1f} МБ"
+        if total:
+            description += f" из {total / 2 ** 20:.1f} МБ ({done * 100 // total}%)"
+        self.update_detailed_status(Status.CONVERTING, description)
+
     def setup_ui(self):
         # Настраиваем сетку окна
         self.root.rowconfigure(0, weight=0)  # хедер фиксированный
@@ -447,5 +457,7 @@ class ModernGuideUploaderApp:
 
 
 if __name__ == "__main__":
+    # нужно для пула процессов перекодирования картинок внутри собранного exe
+    multiprocessing.freeze_support()
     app = ModernGuideUploaderApp()
     app.run()
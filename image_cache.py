@@ -0,0 +1,15 @@
+from constants import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES
+from disk_cache import DiskCache
+
+
+class ImageCache(DiskCache):
+    """
+    Дисковый кэш перекодированных изображений.
+    Ключ — хэш исходных байтов картинки плюс параметры кодирования, значение — готовый файл.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def report(self):
+        print(f"🗃️ Кэш изображений: попаданий {self.hits}, промахов {self.misses}")
@@ -1,8 +1,9 @@
 import zip_postprocessor.main
-from docx_optimizer import select_word_file, extract_images_from_docx, compress_images_in_docx
+from constants import MODERN_IMAGE_FORMATS, CONVERTER_BACKEND, DRIVE_BACKEND
+from docx_optimizer import select_word_file, process_docx_images, DriveImageMode
 from upload_manager.upload_flow import process_upload_flow
 from utils import clear_temp_dir, Status
-from word_to_html_converter import convert
+from word_to_html_converter import convert, prewarm_drive_service
 
 
 def mainAction(app=None):
@@ -13,22 +14,29 @@ def mainAction(app=None):
             # очищаем данные предыдущей методички
             clear_temp_dir()
 
+            # пока открыт диалог выбора файла, в фоне готовим клиент Google Drive
+            if CONVERTER_BACKEND == DRIVE_BACKEND:
+                prewarm_drive_service()
             word_path = select_word_file()
             app.mark_step_done("word_selected")
 
-            images_dir = extract_images_from_docx(word_path)
+            # картинки декодируются один раз для сайта; копия для Google Drive ужимается ровно настолько,
+            # чтобы уложиться в DRIVE_TARGET_SIZE: сконвертированные Google картинки всё равно заменяются нашими.
+            # Локальному движку ничего не отправляется по сети, ему отдаётся исходный файл
+            drive_mode = DriveImageMode.AUTO if CONVERTER_BACKEND == DRIVE_BACKEND else DriveImageMode.ORIGINAL
+            images_dir, compressed_path, duplicates = process_docx_images(
+                word_path, drive_mode=drive_mode, auto_format=True, modern_formats=MODERN_IMAGE_FORMATS
+            )
             app.mark_step_done("images_extracted")
-
-            compressed_path = compress_images_in_docx(word_path)
             app.mark_step_done("docx_compressed")
 
             app.update_status(Status.CONVERTING)
-            converted_path = convert(compressed_path)
+            converted_path = convert(compressed_path, progress_callback=app.show_transfer_progress)
             app.mark_step_done("html_converted")
 
             app.update_status(Status.PROCESSING)
             html_path, upload_zip_path, upload_folder_path = zip_postprocessor.main.run_postprocessing(
-                converted_path, images_dir, word_path
+                converted_path, images_dir, word_path, duplicates, MODERN_IMAGE_FORMATS
             )
             app.mark_step_done("images_renamed")
             app.mark_step_done("upload_prepared")
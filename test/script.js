@@ -1,26 +1,40 @@
 document.addEventListener('DOMContentLoaded', function () {
     document.querySelectorAll(".code-block").forEach(block => {
-        // 1. Собираем строки кода
-        const lines = Array.from(block.querySelectorAll("code")).map(c => c.textContent);
-        const fullText = lines.join("\n");
+        // Компактный блок: один <pre><code class="nohighlight">, строки — <span> внутри него
+        // (nohighlight — чтобы hljs.highlightAll() не склеил строки до этого скрипта)
+        const compactCode = block.classList.contains("compact") ? block.querySelector("code") : null;
 
-        // 2. Подсвечиваем весь код одной строкой
-        const result = hljs.highlightAuto(fullText);
-        const highlightedLines = result.value.split('\n');
+        // Блоки, подсвеченные при сборке, уже содержат готовую разметку
+        if (!block.classList.contains("highlighted")) {
+            // 1. Собираем строки кода
+            const lines = compactCode
+                ? Array.from(compactCode.children).map(span => span.textContent)
+                : Array.from(block.querySelectorAll("code")).map(c => c.textContent);
+            const fullText = lines.join("\n");
 
-        // 3. Очищаем и пересобираем блок с подсветкой
-        block.innerHTML = "";
-        highlightedLines.forEach(lineHtml => {
-            const lineDiv = document.createElement("div");
-            lineDiv.classList.add("line");
+            // 2. Подсвечиваем весь код одной строкой
+            const result = hljs.highlightAuto(fullText);
+            const highlightedLines = result.value.split('\n');
 
-            const codeTag = document.createElement("code");
-            codeTag.className = "hljs";
-            codeTag.innerHTML = lineHtml || "\u200b"; // пустая строка
+            // 3. Очищаем и пересобираем блок с подсветкой
+            if (compactCode) {
+                compactCode.classList.add("hljs");
+                compactCode.innerHTML = highlightedLines.map(lineHtml => `<span>${lineHtml}</span>`).join("\n");
+            } else {
+                block.innerHTML = "";
+                highlightedLines.forEach(lineHtml => {
+                    const lineDiv = document.createElement("div");
+                    lineDiv.classList.add("line");
 
-            lineDiv.appendChild(codeTag);
-            block.appendChild(lineDiv);
-        });
+                    const codeTag = document.createElement("code");
+                    codeTag.className = "hljs";
+                    codeTag.innerHTML = lineHtml || "\u200b"; // пустая строка
+
+                    lineDiv.appendChild(codeTag);
+                    block.appendChild(lineDiv);
+                });
+            }
+        }
 
         // 4. Добавляем кнопку копирования
         const btn = document.createElement('button');
@@ -33,16 +47,19 @@ document.addEventListener('DOMContentLoaded', function () {
         btn.addEventListener('click', function (e) {
             e.stopPropagation();
 
-            const lines = Array.from(block.querySelectorAll('.line')).map(line => {
-                const style = window.getComputedStyle(line);
-                const textIndent = parseIndent(style.textIndent);
-                const marginLeft = parseIndent(style.marginLeft);
-                const totalIndent = textIndent + marginLeft;
-                const tabCount = Math.round(totalIndent / 36);
-                const indent = '\t'.repeat(tabCount > 0 ? tabCount : 0);
+            // В компактном блоке отступы и переносы уже в тексте, а номера строк — псевдоэлементы вне textContent
+            const lines = compactCode
+                ? compactCode.textContent.split('\n').map(line => line.trimEnd())
+                : Array.from(block.querySelectorAll('.line')).map(line => {
+                    const style = window.getComputedStyle(line);
+                    const textIndent = parseIndent(style.textIndent);
+                    const marginLeft = parseIndent(style.marginLeft);
+                    const totalIndent = textIndent + marginLeft;
+                    const tabCount = Math.round(totalIndent / 36);
+                    const indent = '\t'.repeat(tabCount > 0 ? tabCount : 0);
 
-                return indent + line.textContent.replace(/^\d+\s/gm, '').trimEnd();
-            });
+                    return indent + line.textContent.replace(/^\d+\s/gm, '').trimEnd();
+                });
 
             const code = lines.filter(line => line.trim() !== '').join('\n');
 
@@ -1,90 +1,380 @@
+import atexit
 import io
 import os
-from typing import Tuple, Optional
+import queue
+import threading
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
+from datetime import datetime, timedelta, timezone
+from typing import Tuple, Optional, Callable
+from xml.etree import ElementTree
 
+import httplib2
+from google.auth.transport.requests import Request
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 
-from constants import TEMP_DIR
+from constants import TEMP_DIR, CONVERSION_CACHE_DIR, CONVERSION_CACHE_MAX_BYTES, CONVERSION_CACHE_TTL, \
+    DRIVE_UPLOAD_CHUNK_SIZE, DRIVE_DOWNLOAD_CHUNK_SIZE, DRIVE_CHUNK_RETRIES, DRIVE_ORPHAN_MIN_AGE, \
+    DRIVE_DELETE_EXIT_TIMEOUT, DRIVE_BATCH_WORKERS, DRIVE_REQUESTS_PER_SECOND, DRIVE_REQUESTS_BURST, \
+    CONVERTER_BACKEND, DRIVE_BACKEND, LOCAL_BACKEND, BATCH_OUTPUT_DIR
+from disk_cache import DiskCache
+from docx_html_engine import convert_docx_to_html_zip
 from utils import get_resource_path
 
 
-def convert(word_path):
-    converter = WordToHtmlConverter()
+def convert(word_path, progress_callback=None, backend_name=CONVERTER_BACKEND):
+    converter = WordToHtmlConverter(get_converter_backend(backend_name, progress_callback=progress_callback))
     success, path = converter.convert(word_path)
     if not success or not path:
         raise ValueError("Ошибка конвертации")
     return path
 
 
+def convert_batch(word_paths, workers: int = DRIVE_BATCH_WORKERS, service_account_file: str = None,
+                  backend_name=CONVERTER_BACKEND) -> dict:
+    """
+    Конвертирует несколько документов параллельно.
+    Drive: создание, экспорт и удаление идут одновременно в потоках; все запросы проходят через общий
+    ограничитель частоты, а ответы 429 и 403 rateLimitExceeded повторяются с экспоненциальной задержкой
+    (num_retries в googleapiclient). Локальный движок упирается в процессор, поэтому работает в процессах.
+    Каждый документ пишется в свою подпапку BATCH_OUTPUT_DIR/<номер>, чтобы одноимённые docx не затёрли друг друга.
+    Возвращает {путь к docx: путь к zip или None, если конвертация не удалась}.
+    """
+    output_dirs = [BATCH_OUTPUT_DIR / str(i) for i in range(len(word_paths))]
+    for output_dir in output_dirs:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    if backend_name == LOCAL_BACKEND:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        backends = [LocalDocxBackend() for _ in word_paths]
+    else:
+        rate_limiter = TokenBucket(DRIVE_REQUESTS_PER_SECOND, DRIVE_REQUESTS_BURST)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-convert")
+        # у каждого документа свой DriveBackend: клиент Drive привязывается к потоку, который его выполняет
+        backends = [DriveBackend(service_account_file or SERVICE_ACCOUNT_PATH, rate_limiter=rate_limiter,
+                                 thread_client=True) for _ in word_paths]
+
+    started = time.perf_counter()
+    with executor:
+        results = dict(zip(word_paths, executor.map(_convert_with_backend, word_paths, backends, output_dirs)))
+    elapsed = time.perf_counter() - started
+
+    converted = sum(1 for path in results.values() if path)
+    print(f"📊 Пакетная конвертация: {converted} из {len(results)} за {elapsed:.1f} с "
+          f"({converted / elapsed * 60:.1f} док/мин)")
+    return results
+
+
+def _convert_with_backend(word_path, backend, output_dir):
+    success, path = WordToHtmlConverter(backend).convert(word_path, output_dir)
+    return path if success else None
+
+
+def get_converter_backend(name: str = CONVERTER_BACKEND, **options) -> "ConverterBackend":
+    """Движок конвертации по имени: "drive" (Google Drive) или "local" (офлайн, docx_html_engine)"""
+    if name == LOCAL_BACKEND:
+        return LocalDocxBackend()
+    if name == DRIVE_BACKEND:
+        return DriveBackend(**options)
+    raise ValueError(f"Неизвестный движок конвертации: {name}")
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: в среднем rate запросов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 SERVICE_ACCOUNT_PATH = get_resource_path("service_account.json")
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive.file']
+HTTP_TIMEOUT = 120
+GOOGLE_DOC_MIME = 'application/vnd.google-apps.document'
+# Drive принимает не больше 100 запросов в одном batch
+DRIVE_BATCH_LIMIT = 100
 
+# Этапы передачи для progress_callback(stage, done_bytes, total_bytes); total_bytes может быть None
+UPLOAD_STAGE = "upload"
+DOWNLOAD_STAGE = "download"
+ProgressCallback = Callable[[str, int, Optional[int]], None]
 
-class WordToHtmlConverter:
+# Клиенты Google Drive общие на весь процесс: {файл сервисного аккаунта: (creds, drive_service)}
+_drive_clients = {}
+_drive_clients_lock = threading.Lock()
+
+
+def get_drive_service(service_account_file: str = SERVICE_ACCOUNT_PATH, refresh_token: bool = False):
     """
-    Конвертер Word в HTML+ZIP
-    Сохраняет точное оригинальное имя для всех файлов
+    Возвращает (creds, drive_service), создавая их один раз на процесс.
+    Discovery-документ берётся из библиотеки (без запроса к Google), а HTTP-клиент
+    держит соединения открытыми между запросами. refresh_token — сразу получить токен доступа.
     """
+    with _drive_clients_lock:
+        if service_account_file not in _drive_clients:
+            creds = service_account.Credentials.from_service_account_file(service_account_file, scopes=DRIVE_SCOPES)
+            http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+            drive_service = build('drive', 'v3', http=http, static_discovery=True, cache_discovery=False)
+            _drive_clients[service_account_file] = (creds, drive_service)
 
-    def __init__(self, service_account_file: str = SERVICE_ACCOUNT_PATH):
-        if not os.path.exists(service_account_file):
-            raise FileNotFoundError(f"Конфиг файл сервисного аккаунта google не найден: {service_account_file}")
-        self.SERVICE_ACCOUNT_FILE = service_account_file
-        self.creds = None
-        self.drive_service = None
+        creds, drive_service = _drive_clients[service_account_file]
+        if refresh_token and not creds.valid:
+            creds.refresh(Request())
+        return creds, drive_service
 
-    def convert(self, word_path) -> Tuple[bool, Optional[str]]:
-        try:
-            original_name = os.path.splitext(os.path.basename(word_path))[0]
-            output_zip = TEMP_DIR / f"{original_name}.zip"
 
-            if self._convert_to_zip(word_path, output_zip, original_name):
-                print(f"✅ Конвертация прошла успешно. Файл сохранён: {output_zip}")
-                return True, output_zip
+def _worker_http(creds) -> AuthorizedHttp:
+    """Отдельное соединение для фоновых потоков: httplib2.Http нельзя делить между потоками"""
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+
+
+_thread_clients = threading.local()
+
+
+def get_thread_drive_service(service_account_file: str = SERVICE_ACCOUNT_PATH):
+    """(creds, drive_service) со своим HTTP-соединением для текущего потока (пакетная конвертация)"""
+    clients = _thread_clients.__dict__.setdefault('clients', {})
+    if service_account_file not in clients:
+        creds, _ = get_drive_service(service_account_file)
+        drive_service = build('drive', 'v3', http=_worker_http(creds), static_discovery=True, cache_discovery=False)
+        clients[service_account_file] = (creds, drive_service)
+    return clients[service_account_file]
+
+
+# Удаление временных документов из Drive идёт в фоне и не задерживает конвертацию.
+# Поток-демон не держит выход из программы: очередь дорабатывает не дольше DRIVE_DELETE_EXIT_TIMEOUT,
+# а недоудалённые документы убирает cleanup_orphaned_drive_files при следующем запуске
+_deletion_queue = queue.Queue()
+_deletion_pending = set()
+_deletion_lock = threading.Lock()
+_deletion_thread = None
+_deletion_https = {}
+
+
+def schedule_drive_file_deletion(file_id: str, service_account_file: str = SERVICE_ACCOUNT_PATH,
+                                 rate_limiter: Optional[TokenBucket] = None) -> Future:
+    global _deletion_thread
+    future = Future()
+    with _deletion_lock:
+        _deletion_pending.add(future)
+        if _deletion_thread is None:
+            _deletion_thread = threading.Thread(target=_deletion_worker, name="drive-delete", daemon=True)
+            _deletion_thread.start()
+    future.add_done_callback(_deletion_pending.discard)
+    _deletion_queue.put((future, (file_id, service_account_file, rate_limiter)))
+    return future
+
+
+def _deletion_worker():
+    while True:
+        future, args = _deletion_queue.get()
+        if future.set_running_or_notify_cancel():
+            future.set_result(_delete_drive_file(*args))
+
+
+@atexit.register
+def _drain_drive_deletions(timeout: float = DRIVE_DELETE_EXIT_TIMEOUT):
+    """При выходе даёт очереди удалений доработать, но не дольше timeout"""
+    with _deletion_lock:
+        pending = list(_deletion_pending)
+    if pending and wait(pending, timeout=timeout).not_done:
+        print("⚠ Не все временные файлы успели удалиться из Google Drive. Их уберёт очистка при следующем запуске")
+
+
+def _delete_drive_file(file_id: str, service_account_file: str, rate_limiter: Optional[TokenBucket]):
+    try:
+        if rate_limiter:
+            rate_limiter.acquire()
+        creds, drive_service = get_drive_service(service_account_file)
+        if service_account_file not in _deletion_https:
+            _deletion_https[service_account_file] = _worker_http(creds)
+        http = _deletion_https[service_account_file]
+        drive_service.files().delete(fileId=file_id).execute(http=http, num_retries=DRIVE_CHUNK_RETRIES)
+    except Exception as e:
+        print(f"⚠ Не удалось удалить временный файл {file_id} из Google Drive: {e}. "
+              f"Его уберёт очистка при следующем запуске")
 
-            print("❌ Конвертация не удалась.")
-            return False, None
 
+def cleanup_orphaned_drive_files(service_account_file: str = SERVICE_ACCOUNT_PATH,
+                                 min_age: int = DRIVE_ORPHAN_MIN_AGE) -> int:
+    """
+    Удаляет забытые документы сервисного аккаунта (например, если экспорт или удаление упали).
+    Документы моложе min_age не трогаем: их может прямо сейчас конвертировать другой запуск.
+    Возвращает число удалённых файлов.
+    """
+    creds, drive_service = get_drive_service(service_account_file)
+    http = _worker_http(creds)
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=min_age)).strftime('%Y-%m-%dT%H:%M:%S')
+    query = f"'me' in owners and trashed = false and mimeType = '{GOOGLE_DOC_MIME}' and createdTime < '{cutoff}'"
+
+    file_ids = []
+    page_token = None
+    while True:
+        response = drive_service.files().list(
+            q=query, fields='nextPageToken, files(id)', pageSize=1000, pageToken=page_token
+        ).execute(http=http)
+        file_ids += [file['id'] for file in response.get('files', [])]
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+    deleted = _batch_delete(drive_service, file_ids, http)
+    if file_ids:
+        print(f"🧹 Удалено забытых файлов в Google Drive: {deleted} из {len(file_ids)}")
+    return deleted
+
+
+def _batch_delete(drive_service, file_ids, http) -> int:
+    """Удаляет файлы пачками по DRIVE_BATCH_LIMIT за один HTTP-запрос"""
+    deleted = 0
+
+    def on_deleted(request_id, response, exception):
+        nonlocal deleted
+        # 404 — файл уже удалён, например фоновым удалением
+        if exception is None or (isinstance(exception, HttpError) and exception.resp.status == 404):
+            deleted += 1
+        else:
+            print(f"⚠ Не удалось удалить {request_id} из Google Drive: {exception}")
+
+    for start in range(0, len(file_ids), DRIVE_BATCH_LIMIT):
+        batch = drive_service.new_batch_http_request(callback=on_deleted)
+        for file_id in file_ids[start:start + DRIVE_BATCH_LIMIT]:
+            batch.add(drive_service.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute(http=http)
+    return deleted
+
+
+def prewarm_drive_service(service_account_file: str = SERVICE_ACCOUNT_PATH) -> threading.Thread:
+    """Готовит клиент Google Drive в фоне, пока пользователь выбирает файл, и убирает забытые документы"""
+
+    def warm_up():
+        try:
+            get_drive_service(service_account_file, refresh_token=True)
         except Exception as e:
-            print(f"❌ Ошибка: {e}")
-            return False, None
+            print(f"⚠ Не удалось заранее подключиться к Google Drive: {e}")
+            return
+        try:
+            cleanup_orphaned_drive_files(service_account_file)
+        except Exception as e:
+            print(f"⚠ Не удалось очистить Google Drive от забытых файлов: {e}")
+
+    thread = threading.Thread(target=warm_up, daemon=True)
+    if os.path.exists(service_account_file):
+        thread.start()
+    return thread
+
+
+class ConversionCache(DiskCache):
+    """
+    Кэш результатов конвертации: ключ — хэш байтов конвертируемого docx и движок, значение — готовый zip.
+    Повторный запуск того же гайда (например, после ошибки загрузки на сервер) обходится без Google Drive.
+    """
+
+    def __init__(self, cache_dir=CONVERSION_CACHE_DIR, max_bytes=CONVERSION_CACHE_MAX_BYTES,
+                 ttl=CONVERSION_CACHE_TTL):
+        super().__init__(cache_dir, max_bytes, ttl)
+
+    def key_for(self, word_path, backend_name) -> str:
+        return self.make_key(self.file_hash(word_path), backend_name, 'zip')
+
+
+class ConverterBackend(ABC):
+    """
+    Движок конвертации: docx -> zip в раскладке экспорта Google Docs
+    ({имя}.html в корне архива, картинки в images/, в html — <img src="images/...">)
+    """
+    name = None
+
+    @abstractmethod
+    def convert_to_zip(self, word_path: str, output_zip: str, original_name: str) -> bool:
+        """Конвертирует word_path в output_zip; False — конвертация не удалась"""
+
 
-    def _convert_to_zip(self, word_path: str, output_zip: str, original_name: str) -> bool:
+class LocalDocxBackend(ConverterBackend):
+    """Офлайн-конвертация на чистом Python (docx_html_engine): без сети и квот Drive"""
+    name = LOCAL_BACKEND
+
+    def convert_to_zip(self, word_path: str, output_zip: str, original_name: str) -> bool:
+        try:
+            convert_docx_to_html_zip(word_path, output_zip, original_name)
+            return True
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+            print(f"Ошибка локальной конвертации: {e}")
+            return False
+
+
+class DriveBackend(ConverterBackend):
+    """Конвертация через Google Drive: загрузка docx как Google Doc и экспорт в zip"""
+    name = DRIVE_BACKEND
+
+    def __init__(self, service_account_file: str = SERVICE_ACCOUNT_PATH,
+                 progress_callback: Optional[ProgressCallback] = None,
+                 upload_chunk_size: int = DRIVE_UPLOAD_CHUNK_SIZE,
+                 download_chunk_size: int = DRIVE_DOWNLOAD_CHUNK_SIZE,
+                 rate_limiter: Optional[TokenBucket] = None, thread_client: bool = False):
+        if not os.path.exists(service_account_file):
+            raise FileNotFoundError(f"Конфиг файл сервисного аккаунта google не найден: {service_account_file}")
+        self.SERVICE_ACCOUNT_FILE = service_account_file
+        self.creds = None
+        self.drive_service = None
+        self.progress_callback = progress_callback
+        self.upload_chunk_size = upload_chunk_size
+        self.download_chunk_size = download_chunk_size
+        self.rate_limiter = rate_limiter
+        self.thread_client = thread_client
+
+    def convert_to_zip(self, word_path: str, output_zip: str, original_name: str) -> bool:
         if not self._authenticate():
             print("Ошибка аутентификации Google Drive")
             return False
 
+        file_id = None
         try:
             file_metadata = {
                 'name': original_name,
-                'mimeType': 'application/vnd.google-apps.document'
+                'mimeType': GOOGLE_DOC_MIME
             }
 
             media = MediaFileUpload(
                 word_path,
-                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                chunksize=self.upload_chunk_size,
+                resumable=True
             )
 
-            file = self.drive_service.files().create(
+            file = self._upload(self.drive_service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            ), media.size())
             file_id = file['id']
 
             with io.FileIO(output_zip, 'wb') as fh:
-                downloader = MediaIoBaseDownload(
-                    fh,
-                    self.drive_service.files().export_media(
-                        fileId=file_id,
-                        mimeType='application/zip'
-                    )
-                )
-                while not downloader.next_chunk()[1]:
-                    pass
-
-            self.drive_service.files().delete(fileId=file_id).execute()
+                self._download(fh, self.drive_service.files().export_media(
+                    fileId=file_id,
+                    mimeType='application/zip'
+                ))
 
             return True
 
@@ -92,15 +382,92 @@ class WordToHtmlConverter:
             print(f"Ошибка конвертации: {e}")
             return False
 
+        finally:
+            # временный документ удаляется в фоне, в том числе если экспорт упал
+            if file_id:
+                schedule_drive_file_deletion(file_id, self.SERVICE_ACCOUNT_FILE, self.rate_limiter)
+
+    def _upload(self, request, total_size: int) -> dict:
+        """
+        Возобновляемая загрузка по частям. Упавшая часть повторяется сама (next_chunk с num_retries),
+        уже переданные части заново не отправляются.
+        """
+        response = None
+        while response is None:
+            self._throttle()
+            status, response = request.next_chunk(num_retries=DRIVE_CHUNK_RETRIES)
+            if status:
+                self._report_progress(UPLOAD_STAGE, status.resumable_progress, status.total_size)
+        self._report_progress(UPLOAD_STAGE, total_size, total_size)
+        return response
+
+    def _download(self, fh, request):
+        """Скачивание экспорта по частям (Range-запросы) с повтором только упавшей части"""
+        downloader = MediaIoBaseDownload(fh, request, chunksize=self.download_chunk_size)
+        done = False
+        while not done:
+            self._throttle()
+            status, done = downloader.next_chunk(num_retries=DRIVE_CHUNK_RETRIES)
+            self._report_progress(DOWNLOAD_STAGE, status.resumable_progress, status.total_size)
+
+    def _throttle(self):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+    def _report_progress(self, stage: str, done: int, total: Optional[int]):
+        if self.progress_callback:
+            self.progress_callback(stage, done, total)
+
     def _authenticate(self) -> bool:
-        """Аутентификация в Google Drive API"""
+        """Аутентификация в Google Drive API (клиент общий на процесс или свой у потока пакетной конвертации)"""
         try:
-            self.creds = service_account.Credentials.from_service_account_file(
-                self.SERVICE_ACCOUNT_FILE,
-                scopes=['https://www.googleapis.com/auth/drive.file']
-            )
-            self.drive_service = build('drive', 'v3', credentials=self.creds)
+            if self.thread_client:
+                self.creds, self.drive_service = get_thread_drive_service(self.SERVICE_ACCOUNT_FILE)
+            else:
+                self.creds, self.drive_service = get_drive_service(self.SERVICE_ACCOUNT_FILE)
             return True
         except Exception as e:
             print(f"Ошибка аутентификации: {e}")
             return False
+
+
+class WordToHtmlConverter:
+    """
+    Конвертер Word в HTML+ZIP
+    Сохраняет точное оригинальное имя для всех файлов, саму конвертацию выполняет backend
+    """
+
+    def __init__(self, backend: Optional[ConverterBackend] = None, use_cache: bool = True):
+        self.backend = backend or DriveBackend()
+        self.cache = ConversionCache() if use_cache else None
+
+    def convert(self, word_path, output_dir=TEMP_DIR) -> Tuple[bool, Optional[str]]:
+        try:
+            original_name = os.path.splitext(os.path.basename(word_path))[0]
+            output_zip = output_dir / f"{original_name}.zip"
+
+            cache_key = self.cache.key_for(word_path, self.backend.name) if self.cache else None
+            if cache_key and self.cache.get_file(cache_key, output_zip):
+                print(f"♻️ Результат конвертации взят из кэша, повторная конвертация не нужна: {output_zip}")
+                return True, output_zip
+
+            if self.backend.convert_to_zip(word_path, output_zip, original_name):
+                print(f"✅ Конвертация прошла успешно. Файл сохранён: {output_zip}")
+                if cache_key:
+                    self._store_in_cache(cache_key, output_zip)
+                return True, output_zip
+
+            print("❌ Конвертация не удалась.")
+            return False, None
+
+        except Exception as e:
+            print(f"❌ Ошибка: {e}")
+            return False, None
+
+    def _store_in_cache(self, cache_key: str, output_zip):
+        """Ошибка кэша не должна ломать уже удавшуюся конвертацию"""
+        try:
+            self.cache.put_file(cache_key, output_zip)
+            self.cache.evict()
+        except OSError as e:
+            print(f"⚠ Не удалось сохранить результат конвертации в кэш: {e}")
@@ -2,49 +2,46 @@ import shutil
 import zipfile
 from pathlib import Path
 
-from constants import TEMP_DIR
-from zip_postprocessor.html_processing.cleanup import remove_google_redirects
-from zip_postprocessor.html_processing.code_blocks import process_code_sections
+from constants import TEMP_DIR, STREAMING_HTML_MIN_BYTES
+from zip_postprocessor.html_processing.pipeline import HtmlDocument, TransformContext
+from zip_postprocessor.html_processing.streaming import rewrite_html_from_zip
+from zip_postprocessor.image_processing.variants import collect_variants, report_variant_savings
+from zip_postprocessor.utils.archive import read_html_from_zip, html_size_in_zip
 
 
-def prepare_upload_folder(converted_zip_path, images_dir, word_path):
+def prepare_upload_folder(converted_zip_path, images_dir, word_path, image_sources=None, modern_formats=False,
+                          document=None):
     upload_folder = Path(TEMP_DIR / 'upload_folder')
     if upload_folder.exists():
         shutil.rmtree(upload_folder)
     upload_folder.mkdir()
 
-    # Распаковываем ZIP в upload_folder
-    with zipfile.ZipFile(converted_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(upload_folder)
-
-    # Ищем HTML-файл и переименовываем его
-    html_files = list(upload_folder.glob('*.html'))
-    if not html_files:
-        raise FileNotFoundError("HTML файл не найден в распакованном архиве")
+    # Из архива нужен только html: картинки Google заменяются нашими, поэтому архив не распаковывается.
+    # Огромный html в дерево не разбирается, а переписывается потоково прямо из архива
+    streaming = document is None and html_size_in_zip(converted_zip_path) >= STREAMING_HTML_MIN_BYTES
+    if document is None and not streaming:
+        document = HtmlDocument(read_html_from_zip(converted_zip_path))
 
     original_html_name = Path(word_path).stem + '.html'
     original_html_path = upload_folder / original_html_name
-    html_files[0].rename(original_html_path)
 
     upload_zip_path = None
+    variants = {}
 
     # Если images_dir указан и в нём есть изображения — создаём архив
     if images_dir and Path(images_dir).exists():
-        image_files = list(Path(images_dir).glob('*'))
+        image_files = [img_path for img_path in Path(images_dir).glob('*') if img_path.is_file()]
+        if modern_formats:
+            # WebP/AVIF-версии едут в том же архиве, html ссылается на них из <picture>
+            variants = collect_variants(images_dir)
+            report_variant_savings(images_dir, variants)
+            image_files += [variant for image_variants in variants.values() for variant in image_variants]
         if image_files:
-            # Создаём images/ в папке upload_folder
-            images_folder = upload_folder / 'images'
-            images_folder.mkdir(exist_ok=True)
-
-            for img_path in image_files:
-                shutil.copy(img_path, images_folder / img_path.name)
-
-            # ✅ Создаём архив upload.zip с картинками
+            # ✅ Создаём архив upload.zip только с нашими картинками, картинки Google в него не попадают
             upload_zip_path = upload_folder / 'upload.zip'
             with zipfile.ZipFile(upload_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for img_file in images_folder.glob('*'):
-                    arcname = img_file.name
-                    zipf.write(img_file, arcname)
+                for img_path in image_files:
+                    zipf.write(img_path, img_path.name)
 
     print(f"📦 Подготовка завершена:")
     print(f"📝 HTML: {original_html_path}")
@@ -53,22 +50,26 @@ def prepare_upload_folder(converted_zip_path, images_dir, word_path):
     else:
         print("ℹ️ Изображений нет — zip архив не создавался")
 
-    prepare_html(original_html_path)
+    if streaming:
+        rewrite_html_from_zip(converted_zip_path, original_html_path, image_sources, variants)
+    else:
+        prepare_html(original_html_path, image_sources, variants, document)
     return str(original_html_path), str(upload_zip_path) if upload_zip_path else None, upload_folder
 
 
-def prepare_html(html_path):
-    """Основная функция обработки HTML"""
-    # Чтение файла
-    with open(html_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
-
-    # Очистка редиректов от Google
-    html_content = remove_google_redirects(html_content)
+def prepare_html(html_path, image_sources=None, variants=None, document=None):
+    """
+    Основная функция обработки HTML: все преобразования (редиректы Google, src картинок, <picture>,
+    блоки кода) идут по одному разобранному дереву, строка собирается один раз при записи.
+    document — уже разобранный html, иначе читается html_path
+    """
+    if document is None:
+        with open(html_path, 'r', encoding='utf-8') as file:
+            document = HtmlDocument(file.read())
 
-    # Обработка блоков кода
-    html_content = process_code_sections(html_content)
+    document.apply_transforms(TransformContext(image_sources, variants))
 
     # Запись обратно в файл
     with open(html_path, 'w', encoding='utf-8') as file:
-        file.write(html_content)
+        file.write(document.render())
+    document.report_timings()
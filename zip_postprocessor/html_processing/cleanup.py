@@ -1,9 +1,15 @@
 import re
 
+GOOGLE_REDIRECT_PATTERN = re.compile(r'https?://www\.google\.com/url\?q=([^&]+)&.*')
 
-def remove_google_redirects(html_content):
-    return re.sub(
-        r'https?://www\.google\.com/url\?q=([^&]+)&[^"]+',
-        lambda m: m.group(1),
-        html_content
-    )
+
+def remove_google_redirects(soup):
+    """Заменяет ссылки-редиректы Google (google.com/url?q=...) на исходные адреса"""
+    for link in soup.find_all('a', href=True):
+        link['href'] = unwrap_google_redirect(link['href'])
+
+
+def unwrap_google_redirect(href):
+    """Исходный адрес ссылки-редиректа Google; прочие ссылки возвращаются как есть"""
+    match = GOOGLE_REDIRECT_PATTERN.match(href)
+    return match.group(1) if match else href
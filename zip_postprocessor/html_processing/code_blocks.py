@@ -1,99 +1,211 @@
-from bs4 import BeautifulSoup
+import html
+import re
 
+from constants import CODE_BLOCK_MODE, CODE_BLOCK_COMPACT, CODE_HIGHLIGHT
+from zip_postprocessor.html_processing.highlight import highlight_lines, marker_language
 from zip_postprocessor.utils.style_parser import _process_styles
 
-
-def process_code_sections(html_content):
-    """Обрабатывает блоки кода, сохраняя все строки и отступы"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    start_markers, end_markers = _find_code_markers(soup)
-    _validate_markers(start_markers, end_markers)
-
-    for start, end in zip(start_markers, end_markers):
+# тег, комментарий или doctype — то, что html.parser считает разметкой, а не текстом
+TAG_PATTERN = re.compile(r'<[/!?a-zA-Z][^>]*>')
+
+START_MARKER = 'START_CODE_SECTION'
+END_MARKER = 'END_CODE_SECTION'
+MARKER_ERROR = "Непарные маркеры кода"
+SNIPPET_LENGTH = 60
+# невидимый символ в пустой строке построчного блока, чтобы div.line не схлопнулся по высоте
+EMPTY_LINE_TEXT = '\u200b'
+# <pre><code> компактного блока не трогает hljs.highlightAll() на странице: он бы склеил строки-span'ы
+# и сломал номера строк; подсветку строк делает script.js (или она уже есть со сборки)
+NOHIGHLIGHT_CLASS = 'nohighlight'
+
+
+def process_code_sections(soup, mode=CODE_BLOCK_MODE, highlight=CODE_HIGHLIGHT):
+    """
+    Обрабатывает блоки кода в дереве документа, сохраняя все строки и отступы.
+    mode — разметка блока: построчные div.line (CODE_BLOCK_LINES) или один <pre><code> (CODE_BLOCK_COMPACT).
+    highlight — подсветка синтаксиса при сборке для блоков с языком в маркере (START_CODE_SECTION:python)
+    """
+    create_code_block = _create_compact_code_block if mode == CODE_BLOCK_COMPACT else _create_preserved_code_block
+    for start, end in _find_code_markers(soup):
         code_content = _collect_code_content(start, end)
         processed_lines = _process_code_content_with_indents(code_content)
-        code_block = _create_preserved_code_block(soup, processed_lines)
+        language = marker_language(start.get_text()) if highlight else None
+        code_block = create_code_block(soup, *_code_line_tokens(processed_lines, highlight, language))
         _replace_with_code_block(start, end, code_block)
 
-    return str(soup)
-
 
 def _process_code_content_with_indents(code_content):
     """Обрабатывает содержимое кода, сохраняя ВСЕ строки, включая пустые"""
     lines = []
     for element in code_content:
-        # Получаем текст элемента как есть, с сохранением всех переносов
-        text = str(element) if element.name else str(element)
+        # Текст элемента без тегов, с сохранением всех переносов: у тега — его текстовые узлы,
+        # у текстового узла — сам текст, из которого убирается похожая на теги разметка
+        text = element.get_text() if element.name else _strip_tags(str(element))
+        style = element.get('style', '') if element.name == 'p' else ''
+        lines.extend(_element_code_lines(text, style))
 
-        # Разбиваем на строки с сохранением пустых
-        element_lines = text.split('\n') if '\n' in text else [text]
+    return lines
 
-        # Для каждого элемента вычисляем отступ
-        indent_size = 0
-        if element.name == 'p' and element.get('style', ''):
-            styles = element['style'].split(';')
-            _, indent_size = _process_styles(styles)
 
-        for line in element_lines:
-            # Очищаем строку от HTML-тегов (если были)
-            clean_line = BeautifulSoup(line, 'html.parser').get_text()
+def _element_code_lines(text, style=''):
+    """Строки кода одного элемента с отступом из его стиля (style есть только у абзацев)"""
+    # Для каждого элемента вычисляем отступ
+    indent_size = 0
+    if style:
+        _, indent_size = _process_styles(style.split(';'))
 
-            lines.append({
-                'text': clean_line,
-                'indent': indent_size,
-                'is_empty': not clean_line.strip()
-            })
+    # Разбиваем на строки с сохранением пустых
+    element_lines = text.split('\n') if '\n' in text else [text]
+    return [{
+        'text': clean_line,
+        'indent': indent_size,
+        'is_empty': not clean_line.strip()
+    } for clean_line in element_lines]
+
+
+def _code_line_texts(processed_lines):
+    """Текст каждой строки блока кода: отступ пробелами, у пустой строки — только отступ; пустые подряд схлопываются"""
+    for i, line_data in enumerate(processed_lines):
+        # Пропускаем дублирующиеся пустые строки
+        if i > 0 and line_data['is_empty'] and processed_lines[i - 1]['is_empty']:
+            continue
+
+        indent = ' ' * line_data['indent']
+        if line_data['is_empty']:
+            yield indent
+        else:
+            yield indent + line_data['text']
+
+
+def _code_line_tokens(processed_lines, highlight=False, language=None):
+    """
+    Строки блока кода как списки (класс, текст) — класс пустой у неподсвеченного текста — и признак подсветки.
+    У пустой строки остаётся только отступ
+    """
+    texts = list(_code_line_texts(processed_lines))
+    highlighted = highlight_lines(texts, language) if highlight else None
+    if highlighted is None:
+        return [[('', text)] for text in texts], False
+    return highlighted, True
+
+
+def _is_blank(tokens):
+    return not ''.join(text for _, text in tokens).strip()
+
+
+def _code_block_class(base_class, highlighted):
+    """Подсвеченный при сборке блок помечается классом highlighted — клиентская подсветка его не трогает"""
+    return f"{base_class} highlighted" if highlighted else base_class
+
+
+def _append_tokens(soup, tag, tokens):
+    for css_class, text in tokens:
+        if css_class:
+            token_span = soup.new_tag('span', **{'class': css_class})
+            token_span.string = text
+            tag.append(token_span)
+        else:
+            tag.append(text)
 
-    return lines
 
+def _strip_tags(text):
+    """Текст без тегов и с раскодированными сущностями — как get_text() после разбора, но без построения дерева"""
+    return html.unescape(TAG_PATTERN.sub('', text))
 
-def _create_preserved_code_block(soup, processed_lines):
+
+def _create_preserved_code_block(soup, code_lines, highlighted=False):
     """Создает полную структуру блока кода с оберткой и сохранением всех строк"""
     # Создаем внешний контейнер
     code_container = soup.new_tag('div', **{'class': 'code-container'})
 
     # Создаем внутренний блок кода
-    code_block = soup.new_tag('div', **{'class': 'code-block'})
+    code_block = soup.new_tag('div', **{'class': _code_block_class('code-block', highlighted)})
     code_container.append(code_block)
 
     # Добавляем строки кода
-    for i, line_data in enumerate(processed_lines):
-        # Пропускаем дублирующиеся пустые строки
-        if i > 0 and line_data['is_empty'] and processed_lines[i - 1]['is_empty']:
-            continue
-
+    for tokens in code_lines:
         line_div = soup.new_tag('div', **{'class': 'line'})
         code_tag = soup.new_tag('code')
-
-        indent = ' ' * line_data['indent']
-        text = line_data['text']
-
-        if line_data['is_empty']:
-            code_tag.string = indent + '\u200b'  # неразрывный пробел для пустых строк
-        else:
-            code_tag.string = indent + text
-
+        _append_tokens(soup, code_tag, tokens)
+        if _is_blank(tokens):
+            code_tag.append(EMPTY_LINE_TEXT)
         line_div.append(code_tag)
         code_block.append(line_div)
 
     return code_container  # Возвращаем уже готовый контейнер с оберткой
 
 
+def _create_compact_code_block(soup, code_lines, highlighted=False):
+    """
+    Компактный блок кода: один <pre class="code-block compact"><code> с теми же строками.
+    Строка — <span> без классов, строки разделены настоящими переносами, поэтому textContent блока —
+    готовый код для копирования, а номера строк рисует CSS-счётчик на span::before
+    """
+    code_container = soup.new_tag('div', **{'class': 'code-container'})
+    code_block = soup.new_tag('pre', **{'class': _code_block_class('code-block compact', highlighted)})
+    code_tag = soup.new_tag('code', **{'class': NOHIGHLIGHT_CLASS})
+    code_block.append(code_tag)
+    code_container.append(code_block)
+
+    for i, tokens in enumerate(code_lines):
+        if i:
+            code_tag.append('\n')
+        line_span = soup.new_tag('span')
+        _append_tokens(soup, line_span, tokens)
+        code_tag.append(line_span)
+
+    return code_container
+
+
 def _find_code_markers(soup):
-    """Находит маркеры начала и конца кода в HTML"""
-    start_markers = soup.find_all(lambda tag:
-                                  tag.name == 'p' and
-                                  'START_CODE_SECTION' in tag.get_text())
-    end_markers = soup.find_all(lambda tag:
-                                tag.name == 'p' and
-                                'END_CODE_SECTION' in tag.get_text())
-    return start_markers, end_markers
+    """
+    Один проход по абзацам документа: пары (начало, конец) блоков кода в порядке документа.
+    В том же проходе проверяется, что маркеры парные, не вложены друг в друга и стоят в одном контейнере;
+    ошибка указывает на конкретный маркер
+    """
+    pairs = []
+    open_start = None
+    for position, paragraph in enumerate(soup.find_all('p'), 1):
+        text = paragraph.get_text()
+        is_start, is_end = START_MARKER in text, END_MARKER in text
+        if not is_start and not is_end:
+            continue
+
+        if is_start and is_end:
+            raise ValueError(f"{MARKER_ERROR}: {START_MARKER} и {END_MARKER} в одном абзаце "
+                             f"({_marker_location(paragraph, position)})")
+        if is_start:
+            if open_start:
+                start, start_position = open_start
+                raise ValueError(f"{MARKER_ERROR}: {START_MARKER} ({_marker_location(start, start_position)}) "
+                                 f"не закрыт до следующего {START_MARKER} ({_marker_location(paragraph, position)})")
+            open_start = paragraph, position
+            continue
 
+        if not open_start:
+            raise ValueError(f"{MARKER_ERROR}: {END_MARKER} без {START_MARKER} "
+                             f"({_marker_location(paragraph, position)})")
+        start, start_position = open_start
+        if paragraph.parent is not start.parent:
+            raise ValueError(f"{MARKER_ERROR}: {START_MARKER} ({_marker_location(start, start_position)}) и "
+                             f"{END_MARKER} ({_marker_location(paragraph, position)}) в разных блоках документа")
+        pairs.append((start, paragraph))
+        open_start = None
 
-def _validate_markers(start_markers, end_markers):
-    """Проверяет, что маркеры кода парные"""
-    if len(start_markers) != len(end_markers):
-        raise ValueError("Непарные маркеры кода")
+    if open_start:
+        start, start_position = open_start
+        raise ValueError(f"{MARKER_ERROR}: {START_MARKER} не закрыт ({_marker_location(start, start_position)})")
+    return pairs
+
+
+def _marker_location(marker, position):
+    """Где искать маркер в документе: номер абзаца, строка html (если её знает парсер) и соседний текст"""
+    location = f"абзац {position}"
+    if marker.sourceline is not None:
+        location += f", строка html {marker.sourceline}"
+    neighbour = marker.find_next('p') if START_MARKER in marker.get_text() else marker.find_previous('p')
+    snippet = neighbour.get_text().strip()[:SNIPPET_LENGTH] if neighbour else ''
+    return f"{location}, рядом: «{snippet}»" if snippet else location
 
 
 def _collect_code_content(start_marker, end_marker):
@@ -101,15 +213,10 @@ def _collect_code_content(start_marker, end_marker):
     code_content = []
     current = start_marker.next_sibling
 
-    while current and current != end_marker:
-        # Сохраняем все элементы, включая текстовые узлы (которые могут быть пустыми строками)
-        if isinstance(current, str) and current.strip() == '':
-            # Создаем искусственный элемент для пустой строки
-            empty_p = BeautifulSoup('<p></p>', 'html.parser').p
-            empty_p.string = current
-            code_content.append(empty_p)
-        else:
-            code_content.append(current)
+    while current and current is not end_marker:
+        # Сохраняем все элементы, включая текстовые узлы (которые могут быть пустыми строками):
+        # пробельный узел даёт столько же пустых строк, сколько в нём переносов
+        code_content.append(current)
         current = current.next_sibling
 
     return code_content
@@ -175,7 +282,7 @@ def _replace_with_code_block(start_marker, end_marker, code_container):
     start_marker.insert_before(code_container)
 
     current = start_marker
-    while current and current != end_marker:
+    while current and current is not end_marker:
         next_node = current.next_sibling
         current.decompose()
         current = next_node
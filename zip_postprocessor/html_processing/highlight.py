@@ -0,0 +1,92 @@
+import re
+
+from constants import CODE_HIGHLIGHT_CLASS_PREFIX, CODE_HIGHLIGHT_STYLE
+
+try:
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.token import STANDARD_TYPES
+    from pygments.util import ClassNotFound
+
+    # короткие классы, у которых в стиле есть оформление (ровно те, для которых в style.css есть правило .hl-*),
+    # кроме пробелов (w): их цвет не виден, а <span> на каждый отступ только раздувает html
+    STYLED_CLASSES = frozenset(HtmlFormatter(style=CODE_HIGHLIGHT_STYLE).class2style) - {'w'}
+except ImportError:  # подсветка при сборке необязательна: без Pygments блоки кода остаются без неё
+    get_lexer_by_name = None
+
+# язык в маркере начала блока: START_CODE_SECTION:python
+LANGUAGE_HINT = re.compile(r'START_CODE_SECTION:([\w+#.-]+)')
+# лексерам нужен текст как есть: без обрезки переносов по краям и без добавления последнего
+LEXER_OPTIONS = {'stripnl': False, 'ensurenl': False}
+
+_missing_reported = False
+
+
+def marker_language(marker_text):
+    """Язык из подсказки в маркере начала блока или None"""
+    match = LANGUAGE_HINT.search(marker_text)
+    return match.group(1) if match else None
+
+
+def highlight_lines(lines, language=None):
+    """
+    Подсвечивает строки блока кода целиком (многострочные строки и комментарии не рвутся) и режет
+    результат обратно по строкам: [[(класс, текст), ...] на каждую строку], класс пустой у обычного текста.
+    None — если подсветить нечем: нет Pygments, в маркере нет языка (или он неизвестен) или лексер изменил текст.
+    Такой блок остаётся без подсветки при сборке, его подсвечивает highlight.js в script.js
+    """
+    code = '\n'.join(lines)
+    lexer = _find_lexer(language)
+    if lexer is None:
+        return None
+
+    highlighted = [[]]
+    for token_type, value in lexer.get_tokens(code):
+        css_class = _token_class(token_type)
+        for i, part in enumerate(value.split('\n')):
+            if i:
+                highlighted.append([])
+            if part:
+                _append_token(highlighted[-1], css_class, part)
+
+    if len(highlighted) != len(lines) or any(
+            ''.join(text for _, text in tokens) != line for tokens, line in zip(highlighted, lines)):
+        return None
+    return highlighted
+
+
+def _find_lexer(language):
+    """
+    Лексер только по явной подсказке в маркере: guess_lexer Pygments путает обычный учебный код
+    (Python, C) с экзотическими языками, а highlight.js на странице определяет его надёжнее
+    """
+    global _missing_reported
+    if not language:
+        return None
+    if get_lexer_by_name is None:
+        if not _missing_reported:
+            print("⚠ Pygments не установлен — блоки кода собираются без подсветки")
+            _missing_reported = True
+        return None
+
+    try:
+        return get_lexer_by_name(language, **LEXER_OPTIONS)
+    except ClassNotFound:
+        print(f"⚠ Неизвестный язык подсветки '{language}', блок подсветит script.js")
+        return None
+
+
+def _token_class(token_type):
+    """Короткий класс Pygments (k, s2, c1...) с префиксом; у токенов без оформления в стиле (n, p...) — пустой"""
+    while token_type not in STANDARD_TYPES:
+        token_type = token_type.parent
+    css_class = STANDARD_TYPES[token_type]
+    return CODE_HIGHLIGHT_CLASS_PREFIX + css_class if css_class in STYLED_CLASSES else ''
+
+
+def _append_token(tokens, css_class, text):
+    """Соседние куски одного класса сливаются в один <span>"""
+    if tokens and tokens[-1][0] == css_class:
+        tokens[-1] = (css_class, tokens[-1][1] + text)
+    else:
+        tokens.append((css_class, text))
@@ -0,0 +1,78 @@
+import time
+from typing import NamedTuple, Optional
+
+from constants import HTML_PARSER
+from zip_postprocessor.html_processing.cleanup import remove_google_redirects
+from zip_postprocessor.html_processing.code_blocks import process_code_sections
+from zip_postprocessor.image_processing.sources import remap_image_sources
+from zip_postprocessor.image_processing.variants import wrap_pictures
+from zip_postprocessor.utils.html_parser import parse_html, resolve_html_parser, FALLBACK_HTML_PARSER, \
+    LINE_NUMBER_PARSERS
+
+
+class TransformContext(NamedTuple):
+    """Данные, которые нужны преобразованиям html помимо самого дерева"""
+    image_sources: Optional[dict] = None
+    variants: Optional[dict] = None
+
+
+# Упорядоченный список преобразований: (имя, transform(soup, context)), каждое меняет дерево на месте
+HTML_TRANSFORMS = []
+
+
+def register_transform(name, transform):
+    """Добавляет преобразование в конец конвейера"""
+    HTML_TRANSFORMS.append((name, transform))
+
+
+register_transform("google_redirects", lambda soup, context: remove_google_redirects(soup))
+register_transform("image_sources", lambda soup, context: remap_image_sources(soup, context.image_sources))
+register_transform("pictures", lambda soup, context: wrap_pictures(soup, context.variants))
+register_transform("code_sections", lambda soup, context: process_code_sections(soup))
+
+
+class HtmlDocument:
+    """
+    Html гайда, разобранный один раз: все шаги постобработки работают с общим деревом,
+    строка собирается один раз в конце. Время каждого этапа копится в timings.
+    """
+
+    def __init__(self, html_content, parser=HTML_PARSER):
+        self.timings = {}
+        self.html_content = html_content
+        self.parser = resolve_html_parser(parser)
+        self.soup = self._timed("parse", parse_html, html_content, self.parser)
+
+    def apply_transforms(self, context: TransformContext, transforms=None):
+        transforms = list(transforms if transforms is not None else HTML_TRANSFORMS)
+        for i, (name, transform) in enumerate(transforms):
+            try:
+                self._timed(name, transform, self.soup, context)
+            except ValueError as error:
+                raise self._error_with_lines(error, context, transforms[:i + 1]) from None
+
+    def _error_with_lines(self, error, context, transforms):
+        """
+        Ошибка в html (например, непарные маркеры кода) с номерами строк: если парсер их не знает,
+        те же преобразования повторяются на разборе html.parser, и берётся его сообщение
+        """
+        if self.parser in LINE_NUMBER_PARSERS:
+            return error
+        try:
+            HtmlDocument(self.html_content, FALLBACK_HTML_PARSER).apply_transforms(context, transforms)
+        except ValueError as located:
+            return located
+        return error
+
+    def render(self) -> str:
+        return self._timed("serialize", str, self.soup)
+
+    def report_timings(self):
+        steps = ", ".join(f"{name} {seconds * 1000:.1f} мс" for name, seconds in self.timings.items())
+        print(f"⏱️ Обработка html: {steps}")
+
+    def _timed(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - started
+        return result
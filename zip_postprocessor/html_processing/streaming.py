@@ -0,0 +1,418 @@
+import html
+import io
+import os
+import zipfile
+from html.parser import HTMLParser
+from pathlib import Path
+
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.dammit import EntitySubstitution
+from bs4.element import (CharsetMetaAttributeValue, ContentMetaAttributeValue, NavigableString, CData, Comment,
+                         Doctype, Declaration, ProcessingInstruction, nonwhitespace_re)
+from bs4.formatter import HTMLFormatter
+
+from constants import STREAMING_HTML_CHUNK_CHARS, CODE_BLOCK_MODE, CODE_BLOCK_COMPACT, CODE_HIGHLIGHT
+from zip_postprocessor.html_processing.cleanup import unwrap_google_redirect
+from zip_postprocessor.html_processing.code_blocks import (START_MARKER, END_MARKER, MARKER_ERROR, SNIPPET_LENGTH,
+                                                           _element_code_lines, _code_line_tokens, _code_block_class,
+                                                           _is_blank, _strip_tags, EMPTY_LINE_TEXT, NOHIGHLIGHT_CLASS)
+from zip_postprocessor.html_processing.highlight import marker_language
+from zip_postprocessor.image_processing.sources import remap_image_src
+from zip_postprocessor.image_processing.variants import picture_sources
+from zip_postprocessor.utils.archive import find_html_member
+
+# правила дерева BeautifulSoup с html.parser: пустые теги, теги с сохранением пробелов,
+# многозначные атрибуты и особые типы строк (<style>, <script>...) — берём у самого построителя
+TREE_BUILDER = HTMLParserTreeBuilder()
+FORMATTER = HTMLFormatter.REGISTRY["minimal"]
+OUTPUT_ENCODING = "utf-8"
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+# строки этих типов входят в get_text() обычного тега
+MAIN_CONTENT_STRINGS = (NavigableString, CData)
+
+
+class _OpenTag:
+    """Открытый тег на стеке; у абзаца ещё его текст, номер, строка html и начало его вывода в pending"""
+    __slots__ = ("name", "text", "position", "line", "mark")
+
+    def __init__(self, name):
+        self.name = name
+        self.text = None
+
+
+class _Marker:
+    """Абзац с маркером кода: номер среди абзацев, строка html и соседний текст для сообщения об ошибке"""
+    __slots__ = ("position", "line", "snippet")
+
+    def __init__(self, position, line, snippet=""):
+        self.position = position
+        self.line = line
+        self.snippet = snippet
+
+    def __str__(self):
+        location = f"абзац {self.position}, строка html {self.line}"
+        return f"{location}, рядом: «{self.snippet}»" if self.snippet else location
+
+
+class _CodeSection:
+    """Открытый блок кода: уровень его соседей в стеке тегов и уже собранные строки"""
+
+    def __init__(self, start, depth, parent, language=None):
+        self.start = start
+        self.language = language
+        self.depth = depth
+        self.parent = parent
+        self.lines = []
+        # сосед-тег, текст которого сейчас собирается: (имя, style абзаца, куски текста)
+        self.element = None
+
+
+class StreamingHtmlRewriter(HTMLParser):
+    """
+    Потоковый вариант HtmlDocument с html.parser: за один проход по событиям токенизатора
+    убирает редиректы Google, правит src картинок, оборачивает их в <picture> и собирает блоки кода.
+    В памяти держится только стек открытых тегов, текущий абзац и текущий блок кода,
+    поэтому память не растёт с размером документа. Результат совпадает с str(soup) дерева
+    после тех же преобразований.
+    """
+
+    def __init__(self, write, image_sources=None, variants=None, code_block_mode=CODE_BLOCK_MODE,
+                 code_highlight=CODE_HIGHLIGHT):
+        super().__init__(convert_charrefs=False)
+        self.write = write
+        self.image_sources = image_sources or {}
+        self.variants = variants or {}
+        self.code_block_mode = code_block_mode
+        self.code_highlight = code_highlight
+
+        self.stack = []
+        self.text = []
+        self.preserved = 0
+        self.containers = []
+        # пустые теги без явного закрытия: их </img> позже просто пропускается (как в BeautifulSoup)
+        self.closed_void = {}
+
+        # вывод, пока открыт абзац: начало абзаца с маркером START вырезается отсюда
+        self.pending = []
+        self.paragraphs = []
+        self.paragraph_count = 0
+        self.last_paragraph_text = ""
+        self.code = None
+        self.waiting_snippet = None
+
+    # --- события токенизатора ---
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, startend=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, startend=True)
+        if tag not in TREE_BUILDER.empty_element_tags:
+            self._end(tag)
+
+    def handle_endtag(self, tag):
+        if self.closed_void.get(tag):
+            self.closed_void[tag] -= 1
+            return
+        self._end(tag)
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.text.append(character if character is not None else f"&{name}")
+
+    def handle_charref(self, name):
+        self.text.append(html.unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self._special(Comment, data)
+
+    def handle_decl(self, decl):
+        self._special(Doctype, decl[len("DOCTYPE "):])
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._special(CData, data[len("CDATA["):])
+        else:
+            self._special(Declaration, data)
+
+    def handle_pi(self, data):
+        self._special(ProcessingInstruction, data)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        while self.stack:
+            self._pop()
+        if self.code:
+            raise ValueError(f"{MARKER_ERROR}: {START_MARKER} не закрыт ({self.code.start})")
+        self._flush_pending()
+
+    # --- теги ---
+
+    def _start(self, tag, attrs, startend):
+        self._flush_text()
+        attributes = self._attributes(tag, attrs)
+        is_void = tag in TREE_BUILDER.empty_element_tags
+        if tag == 'p':
+            self.paragraph_count += 1
+
+        if self.code and len(self.stack) == self.code.depth:
+            self.code.element = (tag, attributes.get('style', '') if tag == 'p' else '', [])
+            if is_void:
+                self._add_code_text(self.code.element)
+
+        element = _OpenTag(tag)
+        if tag == 'p':
+            # абзац регистрируется до вывода своего тега, чтобы тот попал в pending
+            element.text = []
+            element.position, element.line, element.mark = self.paragraph_count, self.getpos()[0], len(self.pending)
+            self.paragraphs.append(element)
+
+        if tag == 'a' and 'href' in attributes:
+            attributes['href'] = unwrap_google_redirect(attributes['href'])
+        if tag == 'img' and 'src' in attributes:
+            self._emit_image(attributes)
+        else:
+            self._emit(self._format_tag(tag, attributes, is_void))
+
+        if is_void:
+            if not startend:
+                self.closed_void[tag] = self.closed_void.get(tag, 0) + 1
+            return
+
+        if tag in TREE_BUILDER.preserve_whitespace_tags:
+            self.preserved += 1
+        if tag in TREE_BUILDER.string_containers:
+            self.containers.append(tag)
+        self.stack.append(element)
+
+    def _end(self, tag):
+        self._flush_text()
+        if not any(element.name == tag for element in self.stack):
+            return
+        while self._pop().name != tag:
+            pass
+
+    def _pop(self):
+        element = self.stack.pop()
+        self._emit(f"</{element.name}>")
+        if element.name in TREE_BUILDER.preserve_whitespace_tags:
+            self.preserved -= 1
+        if self.containers and self.containers[-1] == element.name:
+            self.containers.pop()
+
+        is_code_end = element.text is not None and self._close_paragraph(element)
+        if self.code and not is_code_end:
+            if len(self.stack) == self.code.depth and self.code.element:
+                self._add_code_text(self.code.element)
+            elif len(self.stack) < self.code.depth:
+                # закрылся контейнер блока кода, а END так и не встретился
+                raise ValueError(f"{MARKER_ERROR}: {START_MARKER} не закрыт ({self.code.start})")
+        if not self.paragraphs:
+            self._flush_pending()
+        return element
+
+    def _close_paragraph(self, paragraph):
+        """Ищет маркеры в закрытом абзаце; True, если он закрыл блок кода"""
+        self.paragraphs.remove(paragraph)
+        text = "".join(paragraph.text)
+        if self.waiting_snippet:
+            self.waiting_snippet.snippet = text.strip()[:SNIPPET_LENGTH]
+            self.waiting_snippet = None
+
+        is_start, is_end = START_MARKER in text, END_MARKER in text
+        if not is_start and not is_end:
+            self.last_paragraph_text = text
+            return False
+
+        # соседний текст — как в _marker_location: у END предыдущий абзац, у START следующий (допишется позже)
+        snippet = self.last_paragraph_text.strip()[:SNIPPET_LENGTH] if is_end else ""
+        marker = _Marker(paragraph.position, paragraph.line, snippet)
+        self.last_paragraph_text = text
+        if is_start and is_end:
+            raise ValueError(f"{MARKER_ERROR}: {START_MARKER} и {END_MARKER} в одном абзаце ({marker})")
+        if is_start:
+            if self.code:
+                raise ValueError(f"{MARKER_ERROR}: {START_MARKER} ({self.code.start}) "
+                                 f"не закрыт до следующего {START_MARKER} ({marker})")
+            # абзац-маркер в результат не попадает, дальше до END соседи только собираются
+            del self.pending[paragraph.mark:]
+            self.code = _CodeSection(marker, len(self.stack), self.stack[-1] if self.stack else None,
+                                     marker_language(text) if self.code_highlight else None)
+            self.waiting_snippet = marker
+            return False
+
+        if not self.code:
+            raise ValueError(f"{MARKER_ERROR}: {END_MARKER} без {START_MARKER} ({marker})")
+        if len(self.stack) != self.code.depth or (self.stack[-1] if self.stack else None) is not self.code.parent:
+            raise ValueError(f"{MARKER_ERROR}: {START_MARKER} ({self.code.start}) и "
+                             f"{END_MARKER} ({marker}) в разных блоках документа")
+        code, self.code = self.code, None
+        self._emit(self._render_code_block(code.lines, code.language))
+        return True
+
+    # --- текст ---
+
+    def _flush_text(self):
+        """Завершает текстовый узел так же, как BeautifulSoup.endData()"""
+        if not self.text:
+            return
+        data = "".join(self.text)
+        self.text = []
+        if not self.preserved and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+
+        string_type = TREE_BUILDER.string_containers.get(self.containers[-1]) if self.containers else None
+        if string_type is None:
+            self._add_paragraph_text(data)
+        self._collect_code(data, string_type or NavigableString)
+
+        parent = self.stack[-1].name if self.stack else None
+        self._emit(data if parent in FORMATTER.cdata_containing_tags else FORMATTER.substitute(data))
+
+    def _special(self, string_class, data):
+        """Комментарий, doctype и прочие строки, которые выводятся как есть"""
+        self._flush_text()
+        if not self.preserved and not data.strip(ASCII_SPACES):
+            data = "\n" if "\n" in data else " "
+        if string_class is CData:
+            self._add_paragraph_text(data)
+        self._collect_code(data, string_class)
+        self._emit(string_class(data).output_ready(FORMATTER))
+
+    def _add_paragraph_text(self, data):
+        """Текст, который get_text() открытых абзацев увидит при поиске маркеров"""
+        for paragraph in self.paragraphs:
+            paragraph.text.append(data)
+
+    def _collect_code(self, data, string_class):
+        """Текст внутри блока кода: узел-сосед даёт строки сразу, текст тега-соседа копится до его закрытия"""
+        if not self.code:
+            return
+        if len(self.stack) == self.code.depth:
+            self.code.lines.extend(_element_code_lines(_strip_tags(data)))
+            return
+        name, _, texts = self.code.element
+        container = TREE_BUILDER.string_containers.get(name)
+        if string_class is container or (container is None and string_class in MAIN_CONTENT_STRINGS):
+            texts.append(data)
+
+    def _add_code_text(self, element):
+        _, style, texts = element
+        self.code.lines.extend(_element_code_lines("".join(texts), style))
+        self.code.element = None
+
+    # --- вывод ---
+
+    def _emit(self, text):
+        if self.code:
+            return
+        if self.paragraphs:
+            self.pending.append(text)
+        else:
+            self.write(text)
+
+    def _flush_pending(self):
+        if self.pending:
+            self.write("".join(self.pending))
+        self.pending = []
+
+    def _emit_image(self, attributes):
+        attributes['src'] = remap_image_src(attributes['src'], self.image_sources)
+        sources = picture_sources(attributes['src'], self.variants)
+        parts = [self._format_tag('source', source, True) for source in sources]
+        parts.append(self._format_tag('img', attributes, True))
+        self._emit(f"<picture>{''.join(parts)}</picture>" if sources else parts[0])
+
+    @staticmethod
+    def _attributes(tag, attrs):
+        """Атрибуты как у тега BeautifulSoup: последний повтор побеждает, многозначные нормализуются"""
+        attributes = {key: value if value is not None else "" for key, value in attrs}
+        list_attributes = (TREE_BUILDER.cdata_list_attributes.get("*", set())
+                           | TREE_BUILDER.cdata_list_attributes.get(tag, set()))
+        for key in list_attributes & attributes.keys():
+            attributes[key] = " ".join(nonwhitespace_re.findall(attributes[key]))
+
+        if tag == 'meta':
+            if 'charset' in attributes:
+                attributes['charset'] = CharsetMetaAttributeValue(
+                    attributes['charset']).substitute_encoding(OUTPUT_ENCODING)
+            elif 'content' in attributes and attributes.get('http-equiv', '').lower() == 'content-type':
+                attributes['content'] = ContentMetaAttributeValue(
+                    attributes['content']).substitute_encoding(OUTPUT_ENCODING)
+        return attributes
+
+    @staticmethod
+    def _format_tag(tag, attributes, is_void=False):
+        formatted = "".join(f" {key}={FORMATTER.quoted_attribute_value(FORMATTER.attribute_value(value))}"
+                            for key, value in sorted(attributes.items()))
+        return f"<{tag}{formatted}{'/' if is_void else ''}>"
+
+    def _render_code_block(self, processed_lines, language=None):
+        """Та же разметка, что у _create_preserved_code_block (или _create_compact_code_block), сразу строкой"""
+        code_lines, highlighted = _code_line_tokens(processed_lines, self.code_highlight, language)
+        if self.code_block_mode == CODE_BLOCK_COMPACT:
+            lines = "\n".join(f'<span>{self._render_tokens(tokens)}</span>' for tokens in code_lines)
+            block_class = _code_block_class('code-block compact', highlighted)
+            return (f'<div class="code-container"><pre class="{block_class}">'
+                    f'<code class="{NOHIGHLIGHT_CLASS}">{lines}</code></pre></div>')
+
+        lines = "".join(f'<div class="line"><code>{self._render_tokens(tokens)}'
+                        f'{EMPTY_LINE_TEXT if _is_blank(tokens) else ""}</code></div>' for tokens in code_lines)
+        block_class = _code_block_class('code-block', highlighted)
+        return f'<div class="code-container"><div class="{block_class}">{lines}</div></div>'
+
+    @classmethod
+    def _render_tokens(cls, tokens):
+        return "".join(f"{cls._format_tag('span', {'class': css_class})}{FORMATTER.substitute(text)}</span>"
+                       if css_class else FORMATTER.substitute(text) for css_class, text in tokens)
+
+
+class _ImageNameScanner(HTMLParser):
+    """Имена файлов из src картинок в порядке появления — без построения дерева"""
+
+    def __init__(self):
+        super().__init__()
+        self.names = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            src = dict(attrs).get('src')
+            if src:
+                self.names.append(Path(src).name)
+
+    handle_startendtag = handle_starttag
+
+
+def _feed_html_from_zip(zip_path, parser):
+    """Скармливает парсеру html из архива кусками, не читая его целиком"""
+    with zipfile.ZipFile(zip_path) as zip_ref, zip_ref.open(find_html_member(zip_ref)) as raw:
+        reader = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        while chunk := reader.read(STREAMING_HTML_CHUNK_CHARS):
+            parser.feed(chunk)
+    parser.close()
+
+
+def scan_html_image_names(zip_path):
+    """Имена картинок из html в архиве (как html_image_names у дерева), одним потоковым проходом"""
+    scanner = _ImageNameScanner()
+    _feed_html_from_zip(zip_path, scanner)
+    return scanner.names
+
+
+def rewrite_html_from_zip(zip_path, html_path, image_sources=None, variants=None):
+    """
+    Потоково пишет обработанный html из архива в html_path.
+    Файл появляется только после успешного прохода: при ошибке в маркерах кода старый не портится.
+    """
+    html_path = Path(html_path)
+    temp_path = html_path.with_name(html_path.name + ".tmp")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as output:
+            _feed_html_from_zip(zip_path, StreamingHtmlRewriter(output.write, image_sources, variants))
+        os.replace(temp_path, html_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from zip_postprocessor.image_processing.rename import final_image_name
+
+
+def map_duplicates_to_html(duplicates, renamed):
+    """
+    Переводит карту дубликатов из docx_optimizer ({локальное имя: локальное имя оригинала})
+    в имена из html, используя результат rename_images_to_match_html.
+    """
+    if not duplicates or not renamed:
+        return {}
+
+    html_duplicates = {}
+    for duplicate, original in duplicates.items():
+        if duplicate in renamed and original in renamed:
+            html_duplicates[renamed[duplicate]] = renamed[original]
+
+    if html_duplicates:
+        print(f"♻️ Дубликатов изображений в html: {len(html_duplicates)}")
+    return html_duplicates
+
+
+def drop_duplicate_files(images_dir, duplicates, renamed):
+    """Удаляет переименованные файлы дубликатов: html ссылается на оригинал, в upload.zip они не нужны"""
+    if not duplicates or not renamed:
+        return
+
+    for duplicate in duplicates:
+        if duplicate in renamed:
+            (Path(images_dir) / final_image_name(renamed[duplicate], duplicate)).unlink(missing_ok=True)
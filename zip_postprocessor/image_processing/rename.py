@@ -1,9 +1,11 @@
 import re
-import tempfile
-import zipfile
 from pathlib import Path
 
-from bs4 import BeautifulSoup
+from zip_postprocessor.utils.archive import read_html_from_zip
+from zip_postprocessor.utils.html_parser import parse_html
+
+# форматы, в которых docx_optimizer сохраняет картинки для сайта
+LOCAL_IMAGE_EXTENSIONS = ('.jpg', '.png', '.webp')
 
 
 def extract_number(name):
@@ -11,7 +13,20 @@ def extract_number(name):
     return int(match.group(1)) if match else 0
 
 
-def rename_images_to_match_html(images_dir_path, converted_zip_path):
+def final_image_name(html_name, local_name):
+    """Имя картинки в upload.zip: имя из html, но с расширением реального формата локального файла"""
+    return Path(html_name).stem + Path(local_name).suffix
+
+
+def rename_images_to_match_html(images_dir_path, converted_zip_path, soup=None, image_names=None,
+                                match_by_name=False):
+    """
+    Переименовывает локальные картинки под имена из html, возвращает {старое имя: имя из html}.
+    soup — уже разобранный html, иначе он читается из архива; image_names — уже собранные
+    имена картинок из html по порядку (потоковый проход без дерева).
+    По умолчанию картинки сопоставляются по порядку: Google нумерует картинки экспорта независимо
+    от word/media. match_by_name — сопоставлять по имени (локальный движок берёт имена из word/media)
+    """
     if not images_dir_path:
         print("⚠️ Путь к изображениям не указан — переименование пропущено.")
         return
@@ -25,78 +40,75 @@ def rename_images_to_match_html(images_dir_path, converted_zip_path):
         print(f"⚠️ Архив не найден: {converted_zip}")
         return
 
-    # Создаем временную директорию для извлечения HTML
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        tmp_dir = Path(tmp_dir)
-        with zipfile.ZipFile(converted_zip, 'r') as zip_ref:
-            zip_ref.extractall(tmp_dir)
-
-        # Ищем HTML-файл в распакованном архиве
-        html_files = list(tmp_dir.glob("*.html"))
-        if not html_files:
-            print("❌ HTML-файл не найден в архиве")
-            return
-
-        html_file = html_files[0]
-
-        # Чтение HTML
-        with open(html_file, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
-
-        img_tags = soup.find_all('img')
-
-        # Собираем ВСЕ имена из HTML (с дубликатами) и УНИКАЛЬНЫЕ имена
-        html_image_names_all = [Path(tag['src']).name for tag in img_tags if tag.get('src')]
-        html_image_names_unique = list(dict.fromkeys(html_image_names_all))  # сохраняем порядок
-
-        # Локальные изображения
-        local_images = sorted(images_dir.glob("*.jpg"),
-                              key=extract_number)  # без сортировки будет неправильная нумерация
-
-        if len(local_images) != len(html_image_names_unique):
-            local_image_names = [img.name for img in local_images]
-            print("\n⚠️ Количество УНИКАЛЬНЫХ изображений не совпадает!")
-
-            print(f"🖼️ Изображений в HTML: {len(html_image_names_unique)}")
-            print("Список изображений в HTML:")
-            for i, name in enumerate(html_image_names_unique, 1):
-                print(f"{i:3d}. {name}")
-
-            print(f"\n📁 Найдено файлов в папке images/: {len(local_images)}")
-            print("Список локальных изображений:")
-            for i, name in enumerate(local_image_names, 1):
-                print(f"{i:3d}. {name}")
-
-            # Находим различия между списками
-            html_set = set(html_image_names_unique)
-            local_set = set(local_image_names)
-
-            missing_in_local = html_set - local_set
-            extra_in_local = local_set - html_set
-
-            if missing_in_local:
-                print("\nФайлы, которые есть в HTML, но отсутствуют локально:")
-                for name in sorted(missing_in_local):
-                    print(f"- {name}")
-
-            if extra_in_local:
-                print("\nФайлы, которые есть локально, но отсутствуют в HTML:")
-                for name in sorted(extra_in_local):
-                    print(f"- {name}")
-
-            print("\nОперация отменена.")
-            return
-
-        # Временное переименование
-        temp_names = []
-        for i, img_path in enumerate(local_images):
-            temp_name = img_path.with_name(f"__temp_{i}.jpg")
-            img_path.rename(temp_name)
-            temp_names.append(temp_name)
-
-        # Переименование по порядку
-        for temp_path, final_name in zip(temp_names, html_image_names_unique):
-            new_path = images_dir / final_name
-            temp_path.rename(new_path)
-
-        print("\n✅ Переименование изображений под html завершено.")
+    if image_names is None:
+        if soup is None:
+            try:
+                soup = parse_html(read_html_from_zip(converted_zip))
+            except FileNotFoundError:
+                print("❌ HTML-файл не найден в архиве")
+                return
+        image_names = [Path(tag['src']).name for tag in soup.find_all('img') if tag.get('src')]
+
+    # Собираем ВСЕ имена из HTML (с дубликатами) и УНИКАЛЬНЫЕ имена
+    html_image_names_all = image_names
+    html_image_names_unique = list(dict.fromkeys(html_image_names_all))  # сохраняем порядок
+
+    # Локальные изображения
+    local_images = sorted((img for img in images_dir.iterdir() if img.suffix.lower() in LOCAL_IMAGE_EXTENSIONS),
+                          key=extract_number)  # без сортировки будет неправильная нумерация
+
+    if match_by_name:
+        html_order = {Path(name).stem: i for i, name in enumerate(html_image_names_unique)}
+        if sorted(html_order) == sorted(img.stem for img in local_images):
+            local_images.sort(key=lambda img: html_order[img.stem])
+        else:
+            print("⚠️ Имена картинок в html не совпадают с локальными — сопоставляем по порядку")
+
+    if len(local_images) != len(html_image_names_unique):
+        local_image_names = [img.name for img in local_images]
+        print("\n⚠️ Количество УНИКАЛЬНЫХ изображений не совпадает!")
+
+        print(f"🖼️ Изображений в HTML: {len(html_image_names_unique)}")
+        print("Список изображений в HTML:")
+        for i, name in enumerate(html_image_names_unique, 1):
+            print(f"{i:3d}. {name}")
+
+        print(f"\n📁 Найдено файлов в папке images/: {len(local_images)}")
+        print("Список локальных изображений:")
+        for i, name in enumerate(local_image_names, 1):
+            print(f"{i:3d}. {name}")
+
+        # Находим различия между списками
+        html_set = set(html_image_names_unique)
+        local_set = set(local_image_names)
+
+        missing_in_local = html_set - local_set
+        extra_in_local = local_set - html_set
+
+        if missing_in_local:
+            print("\nФайлы, которые есть в HTML, но отсутствуют локально:")
+            for name in sorted(missing_in_local):
+                print(f"- {name}")
+
+        if extra_in_local:
+            print("\nФайлы, которые есть локально, но отсутствуют в HTML:")
+            for name in sorted(extra_in_local):
+                print(f"- {name}")
+
+        print("\nОперация отменена.")
+        return
+
+    # Временное переименование
+    temp_names = []
+    for i, img_path in enumerate(local_images):
+        temp_name = img_path.with_name(f"__temp_{i}{img_path.suffix}")
+        img_path.rename(temp_name)
+        temp_names.append(temp_name)
+
+    # Переименование по порядку
+    for temp_path, html_name in zip(temp_names, html_image_names_unique):
+        new_path = images_dir / final_image_name(html_name, temp_path.name)
+        temp_path.rename(new_path)
+
+    print("\n✅ Переименование изображений под html завершено.")
+    return {img_path.name: html_name for img_path, html_name in zip(local_images, html_image_names_unique)}
@@ -0,0 +1,35 @@
+from pathlib import PurePosixPath
+
+from zip_postprocessor.image_processing.rename import final_image_name
+
+
+def build_image_sources(renamed, html_duplicates=None):
+    """
+    Карта {имя картинки в html: имя файла в upload.zip} для всех src, которые надо поправить:
+    картинки, у которых поменялось расширение, и дубликаты, ссылающиеся на общий файл.
+    """
+    if not renamed:
+        return {}
+
+    final_names = {html_name: final_image_name(html_name, local_name) for local_name, html_name in renamed.items()}
+    image_sources = {html_name: final_name for html_name, final_name in final_names.items()
+                     if html_name != final_name}
+    for duplicate, original in (html_duplicates or {}).items():
+        image_sources[duplicate] = final_names[original]
+    return image_sources
+
+
+def remap_image_sources(soup, image_sources):
+    """Заменяет имена файлов в src картинок по карте image_sources"""
+    if not image_sources:
+        return
+
+    for img in soup.find_all('img', src=True):
+        img['src'] = remap_image_src(img['src'], image_sources)
+
+
+def remap_image_src(src, image_sources):
+    """src картинки с именем файла из карты image_sources (или прежний src, если имени в карте нет)"""
+    src_path = PurePosixPath(src)
+    final_name = image_sources.get(src_path.name)
+    return src_path.with_name(final_name).as_posix() if final_name else src
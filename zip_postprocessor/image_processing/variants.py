@@ -0,0 +1,78 @@
+from pathlib import Path, PurePosixPath
+
+from constants import IMAGE_VARIANTS_DIR
+
+# порядок <source> внутри <picture>: браузер берёт первый поддерживаемый
+VARIANT_MIME_TYPES = {'.avif': 'image/avif', '.webp': 'image/webp'}
+
+
+def rename_variants(images_dir, renamed):
+    """Переименовывает WebP/AVIF-версии вслед за основными картинками (через временные имена, как и они)"""
+    if not images_dir or not renamed:
+        return
+    variants_dir = Path(images_dir) / IMAGE_VARIANTS_DIR
+    if not variants_dir.exists():
+        return
+
+    html_stems = {Path(local_name).stem: Path(html_name).stem for local_name, html_name in renamed.items()}
+    temp_names = []
+    for i, variant in enumerate(sorted(variants_dir.iterdir())):
+        if variant.stem in html_stems:
+            temp_name = variant.with_name(f"__temp_{i}{variant.suffix}")
+            variant.rename(temp_name)
+            temp_names.append((temp_name, html_stems[variant.stem]))
+
+    for temp_name, html_stem in temp_names:
+        temp_name.rename(temp_name.with_name(html_stem + temp_name.suffix))
+
+
+def collect_variants(images_dir):
+    """{имя основного файла без расширения: [файлы версий в порядке VARIANT_MIME_TYPES]}"""
+    variants_dir = Path(images_dir) / IMAGE_VARIANTS_DIR
+    if not variants_dir.exists():
+        return {}
+
+    variants = {}
+    for variant in sorted(variants_dir.iterdir(), key=lambda v: list(VARIANT_MIME_TYPES).index(v.suffix)):
+        variants.setdefault(variant.stem, []).append(variant)
+    return variants
+
+
+def wrap_pictures(soup, variants):
+    """Оборачивает <img> с WebP/AVIF-версиями в <picture> с <source> для каждой версии"""
+    if not variants:
+        return
+
+    for img in soup.find_all('img', src=True):
+        sources = picture_sources(img['src'], variants)
+        if not sources:
+            continue
+
+        img.wrap(soup.new_tag('picture'))
+        for source in sources:
+            img.insert_before(soup.new_tag('source', attrs=source))
+
+
+def picture_sources(src, variants):
+    """Атрибуты <source> для картинки src — по одному на каждую её WebP/AVIF-версию"""
+    src_path = PurePosixPath(src)
+    return [{
+        'type': VARIANT_MIME_TYPES[variant.suffix],
+        'srcset': src_path.with_name(variant.name).as_posix()
+    } for variant in variants.get(src_path.stem, [])]
+
+
+def report_variant_savings(images_dir, variants):
+    """Печатает, сколько байт экономят браузеры с поддержкой WebP/AVIF по сравнению с основными картинками"""
+    baseline_total = best_total = 0
+    for image in Path(images_dir).iterdir():
+        if not image.is_file():
+            continue
+        baseline = image.stat().st_size
+        baseline_total += baseline
+        best_total += min([baseline] + [variant.stat().st_size for variant in variants.get(image.stem, [])])
+
+    if baseline_total:
+        saved = baseline_total - best_total
+        print(f"🪶 WebP/AVIF: {baseline_total / 1024:.0f} КБ → {best_total / 1024:.0f} КБ, "
+              f"экономия {saved / 1024:.0f} КБ ({saved / baseline_total:.0%})")
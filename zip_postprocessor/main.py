@@ -1,13 +1,37 @@
+from constants import STREAMING_HTML_MIN_BYTES, CONVERTER_BACKEND, LOCAL_BACKEND
 from .archiver.prepare import prepare_upload_folder
+from .html_processing.pipeline import HtmlDocument
+from .html_processing.streaming import scan_html_image_names
+from .image_processing.dedup import map_duplicates_to_html, drop_duplicate_files
 from .image_processing.rename import rename_images_to_match_html
+from .image_processing.sources import build_image_sources
+from .image_processing.variants import rename_variants
+from .utils.archive import read_html_from_zip, html_size_in_zip
 
 
 # Вся интеграция по шагам:
 # 1. Переименование картинок
-# 2. Подготовка upload zip
-# 3. Обработка HTML
+# 2. Карта src для html: новые расширения и дубликаты, ссылающиеся на общий файл
+# 3. Подготовка upload zip (с WebP/AVIF-версиями, если включены)
+# 4. Обработка HTML
 
-def run_postprocessing(zip_path, images_path, word_path):
-    rename_images_to_match_html(images_path, zip_path)
-    html_path, upload_zip, folder = prepare_upload_folder(zip_path, images_path, word_path)
+def run_postprocessing(zip_path, images_path, word_path, duplicates=None, modern_formats=False,
+                       backend_name=CONVERTER_BACKEND):
+    # локальный движок ссылается на картинки их именами из word/media, экспорт Google — своей нумерацией
+    match_by_name = backend_name == LOCAL_BACKEND
+    if html_size_in_zip(zip_path) >= STREAMING_HTML_MIN_BYTES:
+        # огромный html не разбирается в дерево: имена картинок и итоговый html — потоковыми проходами
+        document = None
+        renamed = rename_images_to_match_html(images_path, zip_path, image_names=scan_html_image_names(zip_path),
+                                              match_by_name=match_by_name)
+    else:
+        # html читается из архива и разбирается один раз, дальше все шаги работают с общим деревом
+        document = HtmlDocument(read_html_from_zip(zip_path))
+        renamed = rename_images_to_match_html(images_path, zip_path, document.soup, match_by_name=match_by_name)
+    rename_variants(images_path, renamed)
+    html_duplicates = map_duplicates_to_html(duplicates, renamed)
+    image_sources = build_image_sources(renamed, html_duplicates)
+    drop_duplicate_files(images_path, duplicates, renamed)
+    html_path, upload_zip, folder = prepare_upload_folder(zip_path, images_path, word_path, image_sources,
+                                                          modern_formats, document)
     return html_path, upload_zip, folder
@@ -0,0 +1,24 @@
+import zipfile
+
+
+def read_html_from_zip(zip_path):
+    """
+    Читает html из архива экспорта напрямую, без распаковки на диск.
+    Html лежит в корне архива, картинки Google в images/ нам не нужны.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return zip_ref.read(find_html_member(zip_ref)).decode('utf-8')
+
+
+def html_size_in_zip(zip_path):
+    """Размер html в архиве после распаковки (байт)"""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return zip_ref.getinfo(find_html_member(zip_ref)).file_size
+
+
+def find_html_member(zip_ref):
+    """Имя html-файла в корне открытого архива экспорта"""
+    html_members = [name for name in zip_ref.namelist() if name.endswith('.html') and '/' not in name]
+    if not html_members:
+        raise FileNotFoundError("HTML файл не найден в архиве")
+    return html_members[0]
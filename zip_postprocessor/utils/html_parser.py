@@ -0,0 +1,26 @@
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+from constants import HTML_PARSER
+
+# парсеры BeautifulSoup от быстрого к медленному; html.parser встроен в Python и есть всегда
+HTML_PARSERS = ('lxml', 'html5lib', 'html.parser')
+FALLBACK_HTML_PARSER = 'html.parser'
+# номер строки (sourceline) у тегов заполняет только html.parser, у lxml и html5lib он всегда None
+LINE_NUMBER_PARSERS = ('html.parser',)
+
+
+def available_html_parsers():
+    return [name for name in HTML_PARSERS if builder_registry.lookup(name)]
+
+
+def resolve_html_parser(name=HTML_PARSER):
+    """Выбранный парсер, если его библиотека установлена, иначе встроенный html.parser"""
+    if builder_registry.lookup(name):
+        return name
+    print(f"⚠ Парсер html '{name}' не установлен, используется {FALLBACK_HTML_PARSER}")
+    return FALLBACK_HTML_PARSER
+
+
+def parse_html(html_content, parser=HTML_PARSER):
+    return BeautifulSoup(html_content, resolve_html_parser(parser))